@@ -0,0 +1,405 @@
+"""
+こうかとんの村の部品ごとのマイクロベンチマーク
+画面なし（SDLのdummyドライバ）で処理を1つずつ計測し，結果を1行1件のJSONで出力する
+使い方：python bench.py [--counts 10 100 1000] [--repeat 5] [--case 名前 ...] [--out ファイル名]
+　　　　python bench.py --startup [--repeat 5]（起動時間の計測）
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # ウィンドウを開かない
+import pygame as pg
+
+import test_1
+
+
+def make_bossbombs(n: int, rng: random.Random, boss: test_1.Boss, bird: test_1.Bird) -> test_1.Bullets:
+    """
+    画面内のランダムな位置にボス爆弾をn個並べた弾の集まりを返す
+    引数1 n：爆弾の数
+    引数2 rng：乱数生成器
+    引数3 boss：爆弾を撃つボス
+    引数4 bird：狙われるこうかとん
+    戻り値：ボス爆弾の弾の集まり
+    """
+    bombs = test_1.Bullets(test_1.BossBomb.colors)
+    for _ in range(n):
+        test_1.BossBomb.spawn(bombs, boss, bird, rng)
+        bombs.pos[bombs.n-1] = rng.randint(20, test_1.WIDTH-20), rng.randint(20, test_1.HEIGHT-20)
+    return bombs
+
+
+def make_enemies(n: int, rng: random.Random) -> pg.sprite.Group:
+    """
+    ランダムな位置に敵機をn体並べたグループを返す
+    引数1 n：敵機の数
+    引数2 rng：乱数生成器
+    戻り値：敵機のグループ
+    """
+    emys = pg.sprite.Group()
+    for _ in range(n):
+        emy = test_1.Flying_enemy(rng)
+        emy.rect.center = rng.randint(20, test_1.WIDTH-20), rng.randint(20, test_1.HEIGHT-20)
+        emys.add(emy)
+    return emys
+
+
+def setup_actors() -> tuple[test_1.Boss, test_1.Bird]:
+    """
+    画面中央上のボスと，床の上のこうかとんを作る
+    戻り値：ボスとこうかとんのタプル
+    """
+    boss = test_1.Boss()
+    boss.rect.center = test_1.WIDTH//2, 150
+    bird = test_1.Bird(3, (550, 500))
+    return boss, bird
+
+
+def bench_bird_update(n: int, rng: random.Random):
+    """
+    こうかとんn羽の移動・重力・ジャンプと床・階層への着地
+    """
+    game = test_1.Game(0)
+    birds = [test_1.Bird(3, (rng.randint(50, test_1.WIDTH-50), rng.randint(50, 500))) for _ in range(n)]
+    key_lst = collections.defaultdict(bool, {pg.K_d: True, pg.K_SPACE: True})
+
+    def run():
+        for bird in birds:
+            bird.update(key_lst)
+            game.land(bird)
+    return run
+
+
+def bench_bossbomb(n: int, rng: random.Random):
+    """
+    ボス爆弾n個の生成と1tick分の移動
+    """
+    boss, bird = setup_actors()
+    bombs = test_1.Bullets(test_1.BossBomb.colors)
+
+    def run():
+        bombs.clear()
+        for _ in range(n):
+            test_1.BossBomb.spawn(bombs, boss, bird, rng)
+        bombs.update()
+    return run
+
+
+def bench_bullet_draw(n: int, rng: random.Random):
+    """
+    ボス爆弾n個の一括描画
+    """
+    screen = pg.display.get_surface()
+    bombs = make_bossbombs(n, rng, *setup_actors())
+
+    def run():
+        screen.blits(bombs.blit_list(0.5)[0], False)
+    return run
+
+
+def bench_sprite_draw(n: int, rng: random.Random):
+    """
+    ビームn本の1本ずつの描画（Group.draw）
+    """
+    screen = pg.display.get_surface()
+    beams = make_beams(n, rng, setup_actors()[1])
+
+    def run():
+        beams.draw(screen)
+    return run
+
+
+def bench_render_queue(n: int, rng: random.Random):
+    """
+    ビームn本の描画待ちへの追加（補間・画面外判定を含む）と，1回のblitsでの描画
+    """
+    screen = pg.display.get_surface()
+    beams = make_beams(n, rng, setup_actors()[1])
+    dirty_rects = test_1.DirtyRects(test_1.Game(0).stage)
+
+    def run():
+        dirty_rects.add_sprites(beams, 0.5)
+        dirty_rects.render(screen)
+    return run
+
+
+def make_beams(n: int, rng: random.Random, bird: test_1.Bird) -> pg.sprite.Group:
+    """
+    画面内のランダムな位置にランダムな向きのビームをn本並べたグループを返す
+    引数1 n：ビームの数
+    引数2 rng：乱数生成器
+    引数3 bird：ビームを放つこうかとん
+    戻り値：ビームのグループ
+    """
+    beams = pg.sprite.Group()
+    for _ in range(n):
+        bird.dire = rng.choice(list(bird.imgs))
+        beam = test_1.Beam(bird)
+        beam.rect.center = rng.randint(20, test_1.WIDTH-20), rng.randint(20, test_1.HEIGHT-20)
+        beams.add(beam)
+    return beams
+
+
+def bench_groupcollide(n: int, rng: random.Random):
+    """
+    敵機n体とビームn本の総当たり衝突判定（groupcollide(emys, beams)）
+    """
+    boss, bird = setup_actors()
+    emys = make_enemies(n, rng)
+    beams = make_beams(n, rng, bird)
+
+    def run():
+        pg.sprite.groupcollide(emys, beams, False, False)
+    return run
+
+
+def bench_grid_groupcollide(n: int, rng: random.Random):
+    """
+    敵機n体とビームn本の空間ハッシュによる衝突判定（セルの作り直しを含む）
+    """
+    boss, bird = setup_actors()
+    emys = make_enemies(n, rng)
+    grid = test_1.SpatialHash(make_beams(n, rng, bird))
+
+    def run():
+        grid.rebuild()
+        grid.groupcollide(emys, False, False)
+    return run
+
+
+def bench_beam_bullets(n: int, rng: random.Random):
+    """
+    ビームn本とボス爆弾n個の衝突判定（全ビームを1回の配列計算でまとめて判定）
+    """
+    boss, bird = setup_actors()
+    bossbombs = make_bossbombs(n, rng, boss, bird)
+    beams = make_beams(n, rng, bird)
+
+    def run():
+        bossbombs.hit_rects([beam.rect for beam in beams], False)
+    return run
+
+
+def bench_spritecollide(n: int, rng: random.Random):
+    """
+    こうかとんとボス爆弾n個の一括衝突判定（円と矩形）
+    """
+    boss, bird = setup_actors()
+    bossbombs = make_bossbombs(n, rng, boss, bird)
+
+    def run():
+        bossbombs.hit_rect(bird.rect, False)
+    return run
+
+
+def bench_grid_spritecollide(n: int, rng: random.Random):
+    """
+    こうかとんと敵機n体の空間ハッシュによる衝突判定（セルの作り直しを含む）
+    """
+    boss, bird = setup_actors()
+    grid = test_1.SpatialHash(make_enemies(n, rng))
+
+    def run():
+        grid.rebuild()
+        grid.spritecollide(bird, False)
+    return run
+
+
+def bench_explosion(n: int, rng: random.Random):
+    """
+    爆発エフェクトn個のアニメーション更新
+    """
+    bombs = make_bossbombs(n, rng, *setup_actors())
+    exps = pg.sprite.Group([test_1.Explosion(center, 10**9) for center in bombs.pos[:n].astype(int).tolist()])
+
+    def run():
+        exps.update()
+    return run
+
+
+def bench_deathk(n: int, rng: random.Random):
+    """
+    デスこうかとんn体の徘徊（狭い範囲で頻繁に向きを変える）
+    """
+    deathks = pg.sprite.Group()
+    for _ in range(n):
+        x = rng.randint(0, test_1.WIDTH-100)
+        deathks.add(test_1.DeathK(x, rng.randint(0, 500), x, 100))
+
+    def run():
+        deathks.update()
+    return run
+
+
+def bench_hud(n: int, rng: random.Random):
+    """
+    ライフとスコアのn回描画（値は50回に1回変わる）
+    """
+    screen = pg.display.get_surface()
+    life, score = test_1.Life((0, 255, 255)), test_1.Score()
+
+    def run():
+        for i in range(n):
+            life.valu = 10 - i//50 % 10
+            score.value = i//50 * 10
+            life.update(screen)
+            score.update(screen)
+    return run
+
+
+def bench_step_chain(n: int, rng: random.Random):
+    """
+    階層n個に対する落下中のこうかとんの着地判定（どれにも乗らない最悪の場合）
+    """
+    game = test_1.Game(0)
+    steps = [test_1.Step(rng.randint(0, test_1.WIDTH-100), rng.randint(300, 550), 100, 20) for _ in range(n)]
+    game.level.platforms = test_1.Platforms(game.level.floors + steps)
+    bird = test_1.Bird(3, (550, 100))
+    bird.velocity_y = 1
+
+    def run():
+        game.land(bird)
+    return run
+
+
+CASES = {
+    "bird_update": bench_bird_update,
+    "bossbomb": bench_bossbomb,
+    "bullet_draw": bench_bullet_draw,
+    "sprite_draw": bench_sprite_draw,
+    "render_queue": bench_render_queue,
+    "groupcollide": bench_groupcollide,
+    "spritecollide": bench_spritecollide,
+    "grid_groupcollide": bench_grid_groupcollide,
+    "beam_bullets": bench_beam_bullets,
+    "grid_spritecollide": bench_grid_spritecollide,
+    "explosion": bench_explosion,
+    "deathk": bench_deathk,
+    "hud": bench_hud,
+    "step_chain": bench_step_chain,
+}
+
+
+STARTUP = """
+import json, os, time
+start = time.perf_counter()
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import test_1
+imported = time.perf_counter()
+import pygame as pg
+pg.init()
+screen = pg.display.set_mode((test_1.WIDTH, test_1.HEIGHT))
+window = time.perf_counter()
+test_1.TitleScene({}).draw(screen)
+pg.display.update()
+title = time.perf_counter()
+print(json.dumps({"import": imported - start, "window": window - start, "title": title - start,
+                  "images": len(test_1.ASSETS.imgs)}))
+"""
+
+
+def bench_startup(repeat: int) -> list[dict]:
+    """
+    新しいプロセスでの起動時間（test_1のimport，画面生成，タイトル画面の最初の描画までの秒数）を計測する
+    別のディレクトリから起動し，作業ディレクトリに頼らず画像を読めることも確かめる
+    引数 repeat：計測の繰り返し回数
+    戻り値：段階ごとの計測結果の辞書のリスト
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", STARTUP], env=env, cwd=os.path.dirname(here),
+                             capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.splitlines()[-1]))
+    results = []
+    for stage in ["import", "window", "title"]:
+        times = [run[stage] for run in runs]
+        results.append({
+            "case": "startup",
+            "stage": stage,
+            "repeat": repeat,
+            "min_ms": min(times) * 1e3,
+            "median_ms": statistics.median(times) * 1e3,
+            "images": runs[-1]["images"],  # タイトル画面までに読み込んだ画像数
+        })
+    return results
+
+
+def measure(run, repeat: int, min_time: float = 0.05) -> tuple[int, list[float]]:
+    """
+    1回の実行時間を計測する．1回の計測がmin_time秒以上になるよう実行回数を決める
+    引数1 run：計測する関数
+    引数2 repeat：計測の繰り返し回数
+    引数3 min_time：1回の計測の最短時間[秒]
+    戻り値：1回の計測での実行回数と，実行1回あたりの秒数のリスト
+    """
+    run()  # ウォームアップ
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        if time.perf_counter() - start >= min_time:
+            break
+        loops *= 2
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        times.append((time.perf_counter() - start) / loops)
+    return loops, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="こうかとんの村のマイクロベンチマーク")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000], help="エンティティ数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の繰り返し回数")
+    parser.add_argument("--case", nargs="+", choices=list(CASES), default=list(CASES), help="計測する項目")
+    parser.add_argument("--out", help="結果を書き出すファイル名（省略時：標準出力）")
+    parser.add_argument("--startup", action="store_true", help="部品ごとの計測の代わりに起動時間を計測する")
+    args = parser.parse_args()
+
+    if args.startup:
+        out = open(args.out, "w") if args.out else sys.stdout
+        for result in bench_startup(args.repeat):
+            print(json.dumps(result), file=out, flush=True)
+        if out is not sys.stdout:
+            out.close()
+        return
+
+    pg.init()
+    pg.display.set_mode((test_1.WIDTH, test_1.HEIGHT))
+    test_1.ASSETS.preload()
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for name in args.case:
+            for n in args.counts:
+                run = CASES[name](n, random.Random(0))
+                loops, times = measure(run, args.repeat)
+                result = {
+                    "case": name,
+                    "n": n,
+                    "loops": loops,
+                    "repeat": args.repeat,
+                    "min_us": min(times) * 1e6,
+                    "median_us": statistics.median(times) * 1e6,
+                    "per_entity_us": statistics.median(times) * 1e6 / n,
+                }
+                print(json.dumps(result), file=out, flush=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    pg.quit()
+
+
+if __name__ == "__main__":
+    main()
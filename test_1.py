@@ -1,29 +1,59 @@
 from pygame.locals import *
+import argparse
+import collections
+import concurrent.futures
+import csv
 import math
 import os
 import random
+import struct
 import sys
 import time
+import zlib
+import numpy as np
 import pygame as pg
 
 
 WIDTH = 1100  # ゲームウィンドウの幅
 HEIGHT = 650  # ゲームウィンドウの高さ
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # 画像ファイルの置き場所（importしても作業ディレクトリは変えない）
 SCREEN_FLAG = False
-
-
-
-def check_bound(obj_rct: pg.Rect) -> tuple[bool, bool]:
+TICK_RATE = 50  # 1秒あたりのシミュレーション回数
+FPS = 120  # 描画フレームレートの上限（0：上限なし）
+MAX_TICKS = 5  # 1回の描画までに進めるシミュレーションの最大回数
+IDLE_WAIT = 250  # 動きのない画面で入力を待つ最長時間[ms]
+CHUNK_WIDTH = WIDTH  # ステージを読み込む単位（チャンク）の幅
+LEVEL = [  # チャンクごとの配置（x座標はチャンクの左端から）．チャンクを並べるほど横に長いステージになる
+    {
+        "steps": [  # 階層の（左上x, 左上y, 幅, 高さ）
+            (0, 400, 300, 20),
+            (800, 400, 300, 20),
+            (0, 200, 300, 20),
+            (800, 200, 300, 20),
+            (450, 300, 200, 20),
+        ],
+        "deathks": [  # デスこうかとんの（左上x, 左上y, 徘徊範囲の左端x, 徘徊範囲の幅）
+            (0, 330, 0, 300),  # step1の上を徘徊
+            (800, 330, 800, 300),  # step2の上を徘徊
+            (0, 500, 0, 1100),  # 床の上を徘徊
+        ],
+    },
+]
+
+
+
+def check_bound(obj_rct: pg.Rect, area: pg.Rect | None = None) -> tuple[bool, bool]:
     """
     オブジェクトが画面内or画面外を判定し，真理値タプルを返す関数
-    引数：こうかとんや爆弾，ビームなどのRect
+    引数1 obj_rct：こうかとんや爆弾，ビームなどのRect
+    引数2 area：判定する範囲のRect（None：ステージ左端の1画面分）
     戻り値：横方向，縦方向のはみ出し判定結果（画面内：True／画面外：False）
     """
+    left, top, right, bottom = (0, 0, WIDTH, HEIGHT) if area is None else (area.left, area.top, area.right, area.bottom)
     yoko, tate = True, True
-    if obj_rct.left < 0 or WIDTH < obj_rct.right:
+    if obj_rct.left < left or right < obj_rct.right:
         yoko = False
-    if obj_rct.top < 0 or HEIGHT < obj_rct.bottom:
+    if obj_rct.top < top or bottom < obj_rct.bottom:
         tate = False
     return yoko, tate
 
@@ -40,6 +70,207 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
+def save_positions(*groups):
+    """
+    各スプライトの現在位置を，描画時の補間用に前tickの位置として記録する
+    引数：スプライトのグループまたはリスト
+    """
+    for group in groups:
+        for spr in group:
+            spr.prev_xy = spr.rect.topleft
+
+
+def lerp_xy(spr: pg.sprite.Sprite, alpha: float) -> tuple[int, int]:
+    """
+    前tickの位置と現在位置の間を補間した描画位置を返す
+    引数1 spr：描画するスプライト
+    引数2 alpha：前tickから現tickまでの進み具合（0.0～1.0）
+    戻り値：描画する左上座標のタプル
+    """
+    x, y = spr.rect.topleft
+    px, py = getattr(spr, "prev_xy", (x, y))  # 生成直後は補間しない
+    return round(px+(x-px)*alpha), round(py+(y-py)*alpha)
+
+
+class Assets:
+    """
+    画像を一度だけ読み込み，全スプライトで共有するSurfaceを配るクラス
+    画像は初めて使われたときに読み込むので，importしただけでは何も読み込まない
+    """
+    files = [  # 事前読み込みする画像ファイル名とα付き変換の有無
+        ("fig/Game-battle-background-1024x576.png", False),
+        ("fig/black01.png", False),
+        ("fig/brown01.png", False),
+        ("fig/beam.png", True),
+        ("fig/explosion.gif", True),
+        ("fig/DeathK.png", True),
+        ("fig/boss.png", True),
+        ("fig/alien1.png", True),
+        ("fig/alien2.png", True),
+        ("fig/alien3.png", True),
+        ("fig/1.png", True),
+        ("fig/2.png", True),
+        ("fig/3.png", True),
+        ("fig/6.png", True),
+        ("fig/8.png", True),
+    ]
+
+    def __init__(self):
+        self.imgs = {}  # ファイル名をキーとした画像Surfaceの辞書
+        self.converted = set()  # 表示形式に変換済みのファイル名
+        self.hits = 0  # キャッシュから返した回数
+        self.misses = 0  # ディスクから読み込んだ回数
+        self.pool = None  # 事前読み込み用のスレッドプール
+        self.pending = {}  # ファイル名をキーとした（読み込み中のFuture, α付き変換の有無）の辞書
+        self.total = 0  # 事前読み込みする画像の数
+        self.sized = {}  # （ファイル名, 大きさ）をキーとした拡大縮小済み画像Surfaceの辞書
+
+    def load(self, path: str, alpha: bool = True) -> pg.Surface:
+        """
+        画像Surfaceを返す．未読み込みの場合のみディスクから読み込む
+        事前読み込み中の画像は，読み込み終わるのを待って受け取る
+        引数1 path：画像ファイル名
+        引数2 alpha：convert_alpha()で変換するか（False：convert()）
+        戻り値：共有の画像Surface
+        """
+        if path in self.pending:  # 読み込みは_receive()でミスとして数える
+            self._receive(path)
+            return self.imgs[path]
+        if path in self.imgs:
+            self.hits += 1
+            return self.imgs[path]
+        self.misses += 1
+        self.imgs[path] = pg.image.load(os.path.join(BASE_DIR, path))
+        self._convert(path, alpha)
+        return self.imgs[path]
+
+    def _convert(self, path: str, alpha: bool):
+        """
+        画面生成後であれば，画像を画面のピクセル形式に変換する
+        引数1 path：画像ファイル名
+        引数2 alpha：convert_alpha()で変換するか
+        """
+        if path in self.converted or pg.display.get_surface() is None:
+            return
+        img = self.imgs[path]
+        self.imgs[path] = img.convert_alpha() if alpha else img.convert()
+        self.converted.add(path)
+
+    def preload(self):
+        """
+        画面生成後に全画像を読み込み，表示形式に変換する
+        （ゲーム中の読み込みによる引っかかりを避けたい計測などで使う）
+        """
+        for path, alpha in __class__.files:
+            if path in self.imgs:
+                self._convert(path, alpha)
+            else:
+                self.load(path, alpha)
+
+    def scaled(self, path: str, size: tuple[int, int], alpha: bool = False) -> pg.Surface:
+        """
+        画像を指定の大きさに拡大縮小して表示形式に変換したSurfaceを返す
+        大きさごとに1回だけ作るので，作り直すのは画面の大きさが変わったときだけになる
+        引数1 path：画像ファイル名
+        引数2 size：拡大縮小後の大きさ（背景なら画面の大きさ）
+        引数3 alpha：convert_alpha()で変換するか（False：convert()）
+        戻り値：共有の画像Surface
+        """
+        key = path, tuple(size)
+        if key in self.sized:
+            return self.sized[key]
+        img = self.load(path, alpha)
+        if img.get_size() != key[1]:
+            img = pg.transform.smoothscale(img, key[1])
+        if pg.display.get_surface() is None:  # 画面生成前は変換できないので保存しない
+            return img
+        self.sized[key] = img.convert_alpha() if alpha else img.convert()
+        return self.sized[key]
+
+    def start_preload(self, workers: int = 4):
+        """
+        未読み込みの全画像のデコードをスレッドプールで始める
+        表示形式への変換はメインスレッドのpoll()かload()で行う
+        引数 workers：デコードに使うスレッド数
+        """
+        if self.pool is not None:
+            return
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        for path, alpha in __class__.files:
+            if path not in self.imgs:
+                self.pending[path] = self.pool.submit(pg.image.load, os.path.join(BASE_DIR, path)), alpha
+        self.total = len(self.pending)
+
+    def poll(self) -> float:
+        """
+        デコードが終わった画像を受け取って表示形式に変換する（メインスレッドで呼ぶ）
+        戻り値：事前読み込みの進み具合（0.0～1.0）
+        """
+        for path in [path for path, (future, _) in self.pending.items() if future.done()]:
+            self._receive(path)
+        return 1.0 if self.total == 0 else 1 - len(self.pending) / self.total
+
+    def ready(self, path: str) -> bool:
+        """
+        画像を待たずに受け取れるか（読み込み済みか）を返す
+        引数 path：画像ファイル名
+        """
+        return path in self.imgs
+
+    def _receive(self, path: str):
+        """
+        事前読み込み中の画像を，デコードが終わるのを待って受け取る
+        引数 path：画像ファイル名
+        """
+        future, alpha = self.pending.pop(path)
+        self.misses += 1
+        self.imgs[path] = future.result()
+        self._convert(path, alpha)
+        if not self.pending:
+            self.pool.shutdown()
+            self.pool = None
+
+    def report(self) -> str:
+        """
+        キャッシュのヒット数とミス数を文字列で返す
+        """
+        return f"assets: {len(self.imgs)} images, hits={self.hits}, misses={self.misses}"
+
+
+ASSETS = Assets()  # 全クラスで共有する画像キャッシュ
+
+
+class Strips:
+    """
+    アニメーションのコマ画像の並びを，画像と変形の組ごとに1回だけ作り，全スプライトで共有するクラス
+    スプライトはコマ番号とタイマーだけを持ち，コマ画像は並びから選ぶ
+    """
+    def __init__(self):
+        self.strips = {}  # （画像ファイル名, 反転, 拡大率）をキーとしたコマ画像のリストの辞書
+
+    def get(self, path: str, mirror: tuple[bool, bool] | None = None, zoom: float = 1.0) -> list[pg.Surface]:
+        """
+        コマ画像の並びを返す．初めての組のときだけ作る
+        引数1 path：画像ファイル名
+        引数2 mirror：（左右, 上下）の反転．指定すると原画の後ろに反転した画像を加えた2コマにする
+        引数3 zoom：拡大率
+        戻り値：コマ画像のリスト（共有しているので書き換えない）
+        """
+        key = path, mirror, zoom
+        if key not in self.strips:
+            img = ASSETS.load(path)
+            if zoom != 1.0:
+                img = pg.transform.rotozoom(img, 0, zoom)
+            frames = [img]
+            if mirror is not None:
+                frames.append(pg.transform.flip(img, *mirror))
+            self.strips[key] = frames
+        return self.strips[key]
+
+
+STRIPS = Strips()  # 全クラスで共有するアニメーションのコマ画像
+
+
 class Bird(pg.sprite.Sprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
@@ -58,11 +289,11 @@ class Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 0.9)
+        img0 = pg.transform.rotozoom(ASSETS.load(f"fig/{num}.png"), 0, 0.9)
         img = pg.transform.flip(img0, True, False)  # 横以外の向きこうかとん
-        img_2 = pg.transform.rotozoom(pg.image.load(f"fig/2.png"), 0, 0.8)
+        img_2 = pg.transform.rotozoom(ASSETS.load("fig/2.png"), 0, 0.8)
         img0_2 = pg.transform.flip(img_2, True, False)  # 横向きのこうかとん
-        img_3 = pg.transform.rotozoom(pg.image.load(f"fig/1.png"), 0, 0.9)
+        img_3 = pg.transform.rotozoom(ASSETS.load("fig/1.png"), 0, 0.9)
         self.imgs = {
             (+1, 0): img_2,  # 右
             (+1, -1): pg.transform.rotozoom(img, 45, 0.9),  # 右上
@@ -73,33 +304,34 @@ class Bird(pg.sprite.Sprite):
             (0, +1): img_3,  # 下
             (+1, +1): img,  # 右下
         }
+        self.hyper_imgs = {  # 向きごとの無敵状態点滅画像（エッジ抽出画像と通常画像）
+            dire: [pg.transform.laplacian(img), img] for dire, img in self.imgs.items()
+        }
         self.dire = (+1, 0)
         self.image = self.imgs[self.dire]
         self.rect = self.image.get_rect()
         self.rect.center = xy
-        self.speed = 5
+        self.speed = 10
         self.life = 3  # ライフを設定
-        self.jump_power = -19  # ジャンプの初速度
-        self.gravity = 1.0  # 重力加速度
+        self.jump_power = -39  # ジャンプの初速度
+        self.gravity = 4.0  # 重力加速度
         self.velocity_y = 0  # 縦方向の速度
         self.state = "normal"  # 通常状態: "normal", 被弾状態: "hyper"
         self.flooting = False  # フローティング状態
         self.hyper_life = 0  # 無敵状態の残りフレーム数
+        self.area = pg.Rect(0, 0, WIDTH, HEIGHT)  # 移動できる範囲（ステージ全体）
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def change_img(self, num: int):
         """
-        こうかとん画像を切り替え，画面に転送する
-        引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
+        こうかとん画像を切り替える
+        引数 num：こうかとん画像ファイル名の番号
         """
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 0.9)
-        screen.blit(self.image, self.rect)
+        self.image = STRIPS.get(f"fig/{num}.png", zoom=0.9)[0]
 
-    def update(self, key_lst: list[bool], screen: pg.Surface):
+    def update(self, key_lst: list[bool]):
         """
         押下キーに応じてこうかとんを移動させる
-        引数1 key_lst：押下キーの真理値リスト
-        引数2 screen：画面Surface
+        引数 key_lst：押下キーの真理値リスト
         """
         sum_mv = [0, 0]
         for k, mv in __class__.delta.items():
@@ -108,7 +340,7 @@ class Bird(pg.sprite.Sprite):
                 sum_mv[1] += mv[1]
         # 水平移動
         self.rect.move_ip(self.speed * sum_mv[0], 0)
-        if check_bound(self.rect) != (True, True):
+        if check_bound(self.rect, self.area) != (True, True):
             self.rect.move_ip(-self.speed * sum_mv[0], 0)
 
         # ジャンプ処理
@@ -132,92 +364,429 @@ class Bird(pg.sprite.Sprite):
 
         # 被弾状態処理
         if self.state == "hyper":
-            self.image = pg.transform.laplacian(self.image)  # 画像を変換
+            self.image = self.hyper_imgs[self.dire][self.hyper_life//5%2]  # 5フレームごとに点滅
             self.hyper_life -= 1
             if self.hyper_life < 0:
                 self.state = "normal"
-        screen.blit(self.image, self.rect)
+                self.image = self.imgs[self.dire]
 
 
-class Bomb(pg.sprite.Sprite):
+def circle_img(rad: int, color: tuple[int, int, int]) -> pg.Surface:
     """
-    爆弾に関するクラス
+    半径rad，色colorの円を描いた背景透過のSurfaceを返す
+    引数1 rad：円の半径
+    引数2 color：円の色
+    戻り値：円のSurface
     """
-    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    img = pg.Surface((2*rad, 2*rad))
+    pg.draw.circle(img, color, (rad, rad), rad)
+    img.set_colorkey((0, 0, 0))
+    return img
+
 
-    def __init__(self, emy: "Flying_enemy", bird: Bird):
+class PooledSprite(pg.sprite.Sprite):
+    """
+    kill()されたときに，生成元のPoolへ戻って再利用されるスプライト
+    Poolから取り出すたびにreset()で初期化し直す
+    """
+    pool = None  # 生成元のPool（Poolを使わずに生成した場合はNone）
+
+    def kill(self):
         """
-        爆弾円Surfaceを生成する
-        引数1 emy：爆弾を投下する敵機
-        引数2 bird：攻撃対象のこうかとん
+        全グループから取り除き，生成元のPoolへ戻す
         """
-        super().__init__()
-        rad = random.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
-        self.image = pg.Surface((2*rad, 2*rad))
-        color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
-        self.rect = self.image.get_rect()
-        # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
-        self.vx, self.vy = calc_orientation(emy.rect, bird.rect)  
-        self.rect.centerx = emy.rect.centerx
-        self.rect.centery = emy.rect.centery+emy.rect.height//2
-        self.speed = 6
+        alive = self.alive()  # 2重に戻さないよう，グループに属していたときだけ戻す
+        super().kill()
+        if alive and self.pool is not None:
+            self.pool.release(self)
 
-    def update(self):
+
+class Pool:
+    """
+    弾やエフェクトのスプライトを使い回すクラス
+    capacity個を事前に確保し，kill()されたものを次の生成に再利用する
+    """
+    def __init__(self, cls: type, capacity: int):
         """
-        爆弾を速度ベクトルself.vx, self.vyに基づき移動させる
-        引数 screen：画面Surface
+        引数1 cls：使い回すPooledSpriteのサブクラス
+        引数2 capacity：確保しておく個数
         """
-        self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-        if check_bound(self.rect) != (True, True):
-            self.kill()
+        self.cls = cls
+        self.capacity = capacity
+        self.free = [self.alloc() for _ in range(capacity)]  # 未使用のスプライト
+
+    def alloc(self) -> PooledSprite:
+        """
+        未初期化のスプライトを1つ作る
+        """
+        spr = self.cls.__new__(self.cls)
+        pg.sprite.Sprite.__init__(spr)
+        spr.pool = self
+        return spr
+
+    def get(self, *args) -> PooledSprite:
+        """
+        未使用のスプライトを取り出し，argsで初期化して返す．足りなければ新しく作る
+        引数：clsのreset()の引数
+        戻り値：初期化済みのスプライト
+        """
+        spr = self.free.pop() if self.free else self.alloc()
+        spr.reset(*args)
+        spr.prev_xy = spr.rect.topleft  # 前回使われたときの位置から補間しない
+        return spr
+
+    def release(self, spr: PooledSprite):
+        """
+        kill()されたスプライトを未使用に戻す
+        引数 spr：戻すスプライト
+        """
+        if len(self.free) < self.capacity:
+            self.free.append(spr)
+
+
+class SpatialHash:
+    """
+    グループのスプライトを一様グリッドのセルに振り分け，矩形の重なり判定の候補を絞り込むクラス
+    判定結果はpg.sprite.spritecollide/spritecollideany/groupcollideと同じ順序・内容になる
+    セルは位置が変わった後，判定が何度も行われたときに作り直す．それまでと，スプライトが少ないときは総当たりで判定する
+    """
+    small = 16  # この数以下なら総当たりの方が速い
+    queries = 4  # 作り直すまでに総当たりで判定する回数
+
+    def __init__(self, group: pg.sprite.AbstractGroup, cell: int = 128):
+        """
+        引数1 group：判定対象のスプライトグループ
+        引数2 cell：セルの一辺の長さ[px]
+        """
+        self.group = group
+        self.cell = cell
+        self.cells = None  # セル座標をキーとした（グループ内の順番, スプライト）のリスト（None：作り直しが必要）
+        self.linear = 0  # 作り直しが必要になってから総当たりで判定した回数
+
+    def rebuild(self):
+        """
+        セルを次の判定時に作り直すよう印を付ける．スプライトの移動・追加後に呼ぶ
+        """
+        self.cells = None
+        self.linear = 0
+
+    def use_cells(self, queries: int = 1) -> bool:
+        """
+        これからqueries回の判定をセルで行うかを決め，必要ならセルを作る
+        引数 queries：これから行う判定の回数
+        戻り値：セルで判定するかどうかの真偽値
+        """
+        if self.cells is None:
+            if len(self.group) <= __class__.small or self.linear+queries <= __class__.queries:
+                self.linear += queries
+                return False
+            self.build()
+        return True
+
+    def build(self):
+        """
+        グループの現在の位置でセルを作る
+        """
+        cell, cells = self.cell, {}
+        for i, spr in enumerate(self.group):
+            rct = spr.rect
+            for cx in range(rct.left//cell, (rct.right-1)//cell+1):
+                for cy in range(rct.top//cell, (rct.bottom-1)//cell+1):
+                    cells.setdefault((cx, cy), []).append((i, spr))
+        self.cells = cells
+
+    def query(self, rct: pg.Rect) -> list[pg.sprite.Sprite]:
+        """
+        セルを使い，矩形と重なる，グループに残っているスプライトをグループ内の順番で返す
+        引数 rct：矩形
+        戻り値：重なるスプライトのリスト
+        """
+        alive = self.group.spritedict  # kill()されずにグループに残っているスプライト
+        cell = self.cell
+        x0, x1 = rct.left//cell, (rct.right-1)//cell
+        y0, y1 = rct.top//cell, (rct.bottom-1)//cell
+        if x0 == x1 and y0 == y1:  # 1つのセルに収まる場合は重複も並べ替えも不要
+            return [spr for _, spr in self.cells.get((x0, y0), ()) if spr in alive and rct.colliderect(spr.rect)]
+        found = {}
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                for i, spr in self.cells.get((cx, cy), ()):
+                    if i not in found and spr in alive and rct.colliderect(spr.rect):
+                        found[i] = spr
+        return [found[i] for i in sorted(found)]
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, dokill: bool) -> list[pg.sprite.Sprite]:
+        """
+        pg.sprite.spritecollide(sprite, group, dokill)と同じ判定を行う
+        """
+        if not self.use_cells():
+            return pg.sprite.spritecollide(sprite, self.group, dokill)
+        hits = self.query(sprite.rect)
+        if dokill:
+            for spr in hits:
+                spr.kill()
+        return hits
+
+    def spritecollideany(self, sprite: pg.sprite.Sprite) -> pg.sprite.Sprite | None:
+        """
+        pg.sprite.spritecollideany(sprite, group)と同じ判定を行う
+        """
+        if not self.use_cells():
+            return pg.sprite.spritecollideany(sprite, self.group)
+        hits = self.query(sprite.rect)
+        return hits[0] if hits else None
+
+    def groupcollide(self, groupa: pg.sprite.AbstractGroup, dokilla: bool, dokillb: bool) -> dict:
+        """
+        pg.sprite.groupcollide(groupa, group, dokilla, dokillb)と同じ判定を行う
+        """
+        if not self.group or not groupa:  # どちらかが空なら判定しない
+            return {}
+        if not self.use_cells(len(groupa)):
+            return pg.sprite.groupcollide(groupa, self.group, dokilla, dokillb)
+        crashed = {}
+        for spr in groupa.sprites():
+            hits = self.query(spr.rect)
+            if hits:
+                if dokillb:
+                    for hit in hits:
+                        hit.kill()
+                crashed[spr] = hits
+                if dokilla:
+                    spr.kill()
+        return crashed
+
+
+class Bullets:
+    """
+    円形の弾の位置・速度・半径・色をNumPy配列でまとめて持ち，
+    移動・画面外判定・当たり判定・描画を全弾一括で行うクラス
+    """
+    def __init__(self, colors: list[tuple[int, int, int]], capacity: int = 256):
+        """
+        引数1 colors：弾の色のリスト（弾ごとにはこのリストの添字を持つ）
+        引数2 capacity：最初に確保する弾の数（足りなくなったら倍に増やす）
+        """
+        self.colors = colors
+        self.imgs = {}  # （半径, 色の添字）をキーとした弾円Surfaceの辞書
+        self.n = 0  # 生きている弾の数（配列の先頭n個が有効）
+        self.pos = np.zeros((capacity, 2))  # 中心座標
+        self.prev = np.zeros((capacity, 2))  # 前tickの中心座標（描画の補間用）
+        self.vel = np.zeros((capacity, 2))  # 1tickあたりの移動量
+        self.rad = np.zeros(capacity, dtype=np.int32)  # 半径
+        self.color = np.zeros(capacity, dtype=np.int32)  # 色の添字
+
+    def __len__(self) -> int:
+        return self.n
+
+    def spawn(self, xy: tuple[float, float], vxy: tuple[float, float], rad: int, color: int):
+        """
+        弾を1個追加する
+        引数1 xy：中心座標
+        引数2 vxy：1tickあたりの移動量
+        引数3 rad：半径
+        引数4 color：色の添字
+        """
+        if self.n == len(self.rad):
+            for name in ("pos", "prev", "vel", "rad", "color"):
+                arr = getattr(self, name)
+                setattr(self, name, np.concatenate([arr, np.zeros_like(arr)]))
+        i = self.n
+        self.pos[i] = self.prev[i] = xy
+        self.vel[i] = vxy
+        self.rad[i] = rad
+        self.color[i] = color
+        self.n += 1
+
+    def keep(self, mask: np.ndarray):
+        """
+        maskがTrueの弾だけを順番を保って先頭に詰め，残りを消す
+        引数 mask：生きている弾ごとの真理値配列
+        """
+        k = int(np.count_nonzero(mask))
+        for arr in (self.pos, self.prev, self.vel, self.rad, self.color):
+            arr[:k] = arr[:self.n][mask]
+        self.n = k
+
+    def clear(self):
+        """
+        全ての弾を消す
+        """
+        self.n = 0
+
+    def update(self, view: pg.Rect | None = None):
+        """
+        全弾を移動させ，画面から少しでもはみ出した弾を消す
+        引数 view：画面に映っている範囲のRect（None：ステージ左端の1画面分）
+        """
+        if self.n == 0:  # 弾がないときは配列計算をしない
+            return
+        if view is None:
+            view = pg.Rect(0, 0, WIDTH, HEIGHT)
+        n = self.n
+        self.prev[:n] = self.pos[:n]
+        self.pos[:n] += self.vel[:n]
+        x, y, r = self.pos[:n, 0], self.pos[:n, 1], self.rad[:n]
+        self.keep((x-r >= view.left) & (x+r <= view.right) & (y-r >= view.top) & (y+r <= view.bottom))
+
+    def hit_rect(self, rct: pg.Rect, dokill: bool = True) -> np.ndarray:
+        """
+        矩形に触れている弾（円と矩形の最近点が半径以内）を調べる
+        引数1 rct：当たり判定に使うRect
+        引数2 dokill：触れた弾を消すか
+        戻り値：触れた弾の中心座標の配列（触れた弾がなければ長さ0）
+        """
+        if self.n == 0:
+            return self.pos[:0]
+        pos, r = self.pos[:self.n], self.rad[:self.n]
+        dx = pos[:, 0] - np.clip(pos[:, 0], rct.left, rct.right)
+        dy = pos[:, 1] - np.clip(pos[:, 1], rct.top, rct.bottom)
+        hit = dx*dx + dy*dy < r*r
+        centers = pos[hit]
+        if dokill and len(centers):
+            self.keep(~hit)
+        return centers
+
+    def hit_rects(self, rcts: list[pg.Rect], dokill: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """
+        複数の矩形それぞれに触れている弾を1回の配列計算でまとめて調べる
+        複数の矩形に触れた弾は，リストで先にある矩形だけに触れたものとする
+        引数1 rcts：当たり判定に使うRectのリスト
+        引数2 dokill：触れた弾を消すか
+        戻り値：触れた矩形の添字の配列と，触れた弾の中心座標の配列のタプル（矩形の順，同じ矩形内は弾の順）
+        """
+        if self.n == 0 or not rcts:
+            return np.zeros(0, dtype=int), self.pos[:0]
+        pos, r = self.pos[:self.n], self.rad[:self.n]
+        box = np.array([(rct.left, rct.top, rct.right, rct.bottom) for rct in rcts], dtype=float)
+        dx = pos[:, 0] - np.clip(pos[:, 0], box[:, 0:1], box[:, 2:3])  # （矩形の数, 弾の数）
+        dy = pos[:, 1] - np.clip(pos[:, 1], box[:, 1:2], box[:, 3:4])
+        hit = dx*dx + dy*dy < r*r
+        hit_any = hit.any(axis=0)
+        idx = np.flatnonzero(hit_any)
+        owners = hit[:, idx].argmax(axis=0)  # 弾ごとに最初に触れた矩形
+        order = np.argsort(owners, kind="stable")
+        owners, centers = owners[order], pos[idx[order]]
+        if dokill and len(idx):
+            self.keep(~hit_any)
+        return owners, centers
+
+    def blit_list(self, alpha: float, cam_x: int = 0, size: tuple[int, int] = (WIDTH, HEIGHT)) -> tuple[list, int]:
+        """
+        画面に映る弾の画像と，前tickと現tickの間に補間した描画位置の組を作る
+        引数1 alpha：前tickから現tickまでの進み具合（0.0～1.0）
+        引数2 cam_x：画面左端のx座標
+        引数3 size：画面の大きさ
+        戻り値：（画像, 左上座標）のリストと，画面外のため描画しない弾の数のタプル
+        """
+        n = self.n
+        if n == 0:
+            return [], 0
+        r = self.rad[:n]
+        xy = (self.prev[:n] + (self.pos[:n]-self.prev[:n])*alpha - r[:, None]).astype(int)
+        xy[:, 0] -= cam_x
+        sw, sh = size
+        shown = (xy[:, 0] < sw) & (xy[:, 1] < sh) & (xy[:, 0]+2*r > 0) & (xy[:, 1]+2*r > 0)
+        imgs = self.imgs
+        seq = []
+        for key, topleft in zip(zip(r[shown].tolist(), self.color[:n][shown].tolist()), xy[shown].tolist()):
+            if key not in imgs:
+                imgs[key] = circle_img(key[0], self.colors[key[1]])
+            seq.append((imgs[key], topleft))
+        return seq, n - len(seq)
+
+
+class Bomb:
+    """
+    敵機が投下する爆弾の種類（弾そのものはBulletsでまとめて管理する）
+    """
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    speed = 6
+
+    @staticmethod
+    def spawn(bullets: Bullets, emy: "Flying_enemy", bird: Bird, rng: random.Random = random):
+        """
+        敵機の下端からこうかとんに向けて爆弾を1個投下する
+        引数1 bullets：爆弾を追加する弾の集まり
+        引数2 emy：爆弾を投下する敵機
+        引数3 bird：攻撃対象のこうかとん
+        引数4 rng：乱数生成器
+        """
+        rad = rng.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
+        color = rng.randrange(len(__class__.colors))  # 爆弾円の色：クラス変数からランダム選択
+        # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
+        vx, vy = calc_orientation(emy.rect, bird.rect)
+        xy = emy.rect.centerx, emy.rect.centery+emy.rect.height//2
+        bullets.spawn(xy, (__class__.speed*vx, __class__.speed*vy), rad, color)
 
-class Beam(pg.sprite.Sprite):
+class Beam(PooledSprite):
     """
     ビームに関するクラス
     """
+    imgs = {}  # こうかとんの向きをキーとした（回転済み画像, vx, vy）の辞書
+
     def __init__(self, bird: Bird):
         """
         ビーム画像Surfaceを生成する
         引数 bird：ビームを放つこうかとん
         """
         super().__init__()
-        self.vx, self.vy = bird.dire
-        angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/beam.png"), angle, 1.0)
-        self.vx = math.cos(math.radians(angle))
-        self.vy = -math.sin(math.radians(angle))
+        self.reset(bird)
+
+    def reset(self, bird: Bird):
+        """
+        ビームを初期化する（引数は__init__と同じ）
+        """
+        if bird.dire not in __class__.imgs:  # 初めての向きのときだけ回転画像を作る
+            __class__.imgs[bird.dire] = __class__.rotate(bird.dire)
+        self.image, self.vx, self.vy = __class__.imgs[bird.dire]
         self.rect = self.image.get_rect()
         self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
         self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
         self.speed = 10
 
-    def update(self):
+    @staticmethod
+    def rotate(dire: tuple[int, int]) -> tuple[pg.Surface, float, float]:
         """
-        ビームを速度ベクトルself.vx, self.vyに基づき移動させる
-        引数 screen：画面Surface
+        向きに応じて回転したビーム画像と単位速度ベクトルを計算する
+        引数 dire：こうかとんの向きタプル
+        戻り値：回転済みビーム画像，横方向速度，縦方向速度のタプル
+        """
+        angle = math.degrees(math.atan2(-dire[1], dire[0]))
+        img = pg.transform.rotozoom(ASSETS.load("fig/beam.png"), angle, 1.0)
+        return img, math.cos(math.radians(angle)), -math.sin(math.radians(angle))
+
+    def update(self, view: pg.Rect | None = None):
+        """
+        ビームを速度ベクトルself.vx, self.vyに基づき移動させ，画面外に出たら消す
+        引数 view：画面に映っている範囲のRect（None：ステージ左端の1画面分）
         """
         self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-        if check_bound(self.rect) != (True, True):
+        if check_bound(self.rect, view) != (True, True):
             self.kill()
 
 
-class Explosion(pg.sprite.Sprite):
+class Explosion(PooledSprite):
     """
     爆発に関するクラス
     """
-    def __init__(self, obj: "Bomb|Flying_enemy", life: int):
+
+    def __init__(self, center: tuple[int, int], life: int):
         """
         爆弾が爆発するエフェクトを生成する
-        引数1 obj：爆発するBombまたは敵機インスタンス
+        引数1 center：爆発する爆弾または敵機の中心座標
         引数2 life：爆発時間
         """
         super().__init__()
-        img = pg.image.load(f"fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
-        self.image = self.imgs[0]
-        self.rect = self.image.get_rect(center=obj.rect.center)
+        self.reset(center, life)
+
+    def reset(self, center: tuple[int, int], life: int):
+        """
+        爆発を初期化する（引数は__init__と同じ）
+        """
+        self.frames = STRIPS.get("fig/explosion.gif", (True, True))  # 爆発画像と上下左右反転画像
+        self.image = self.frames[0]
+        self.rect = self.image.get_rect(center=center)
         self.life = life
 
 
@@ -227,7 +796,7 @@ class Explosion(pg.sprite.Sprite):
         爆発エフェクトを表現する
         """
         self.life -= 1
-        self.image = self.imgs[self.life//10%2]
+        self.image = self.frames[self.life//10%2]
         if self.life < 0:
             self.kill()
 
@@ -235,30 +804,32 @@ class Floor:
     """
     床に関するクラス
     """
-    def __init__(self):
+    def __init__(self, x: int = 0, width: int = WIDTH):
         """
         床画像Surfaceを生成する
+        引数 x, width：床の左端の座標と幅
         """
         super().__init__()
-        self.image = pg.image.load(f"fig/black01.png")
+        self.image = ASSETS.load("fig/black01.png", False)
         self.tile_size = self.image.get_size()
-        self.width = WIDTH
+        self.width = width
         self.height = 80
         self.surface = pg.Surface((self.width, self.height))
         self.rect = self.surface.get_rect()
-        self.rect.topleft = (0, HEIGHT - self.height)
+        self.rect.topleft = (x, HEIGHT - self.height)
 
         # タイル画像を繰り返し描画
         for x in range(0, self.width, self.tile_size[0]):
             for y in range(0, self.height, self.tile_size[1]):
                 self.surface.blit(self.image, (x, y))
 
-    def update(self, screen: pg.Surface):
+    def update(self, screen: pg.Surface, cam_x: int = 0):
         """
         床を画面に描画する
-        引数 screen：画面Surface
+        引数1 screen：画面Surface
+        引数2 cam_x：画面左端のx座標
         """
-        screen.blit(self.surface, self.rect)
+        screen.blit(self.surface, self.rect.move(-cam_x, 0))
 
     def check_collision(self, bird_rect):
         """
@@ -279,7 +850,7 @@ class Step():
         引数 width, height：階層の幅と高さ
         """
         super().__init__()
-        self.image = pg.image.load(f"fig/brown01.png")
+        self.image = ASSETS.load("fig/brown01.png", False)
         self.tile_size = self.image.get_size()
         self.width = width
         self.height = height
@@ -292,12 +863,13 @@ class Step():
             for y in range(0, self.height, self.tile_size[1]):
                 self.surface.blit(self.image, (x, y))
 
-    def update(self, screen: pg.Surface):
+    def update(self, screen: pg.Surface, cam_x: int = 0):
         """
         階層を画面に描画する
-        引数 screen：画面Surface
+        引数1 screen：画面Surface
+        引数2 cam_x：画面左端のx座標
         """
-        screen.blit(self.surface, self.rect)
+        screen.blit(self.surface, self.rect.move(-cam_x, 0))
     
     def check_collision(self, bird_rect):
         """
@@ -307,17 +879,148 @@ class Step():
         """
         return self.rect.colliderect(bird_rect)
 
+
+class Platforms:
+    """
+    床・階層を横方向の列ごとに登録し，こうかとんが触れている床・階層を近くの列だけから探すクラス
+    床・階層を動かしたときは作り直す
+    """
+    def __init__(self, plats: list["Floor | Step"], cell: int = 64):
+        """
+        引数1 plats：床・階層のリスト（先にあるものほど優先して乗る）
+        引数2 cell：列の幅
+        """
+        self.plats = plats
+        self.cell = cell
+        self.cols = {}  # 列番号をキーとした，その列に掛かる床・階層の番号（昇順）リストの辞書
+        for i, plat in enumerate(plats):
+            for col in range(plat.rect.left//cell, (plat.rect.right-1)//cell+1):
+                self.cols.setdefault(col, []).append(i)
+
+    def find(self, rct: pg.Rect) -> "Floor | Step | None":
+        """
+        矩形に触れている床・階層のうち，最も優先されるものを返す
+        引数 rct：こうかとんの矩形
+        戻り値：触れている床・階層（なければNone）
+        """
+        first, last = rct.left//self.cell, (rct.right-1)//self.cell
+        if first == last:
+            cands = self.cols.get(first, ())
+        else:  # 複数の列に掛かるときは番号順に並べ直す
+            cands = sorted({i for col in range(first, last+1) for i in self.cols.get(col, ())})
+        for i in cands:
+            if self.plats[i].check_collision(rct):
+                return self.plats[i]
+        return None
+
+
+class Camera:
+    """
+    こうかとんが画面中央に来るように横方向にスクロールする視点に関するクラス
+    """
+    def __init__(self, world_width: int):
+        """
+        引数 world_width：ステージ全体の幅
+        """
+        self.world_width = world_width
+        self.x = 0  # 画面左端のx座標
+        self.prev_x = 0  # 前tickの画面左端のx座標（描画の補間用）
+        self.view = pg.Rect(0, 0, WIDTH, HEIGHT)  # 画面に映っている範囲
+
+    def follow(self, rct: pg.Rect):
+        """
+        対象が画面中央に来るように視点を動かす．ステージの端より外は映さない
+        引数 rct：追いかける対象の矩形
+        """
+        self.prev_x = self.x
+        self.x = min(max(rct.centerx - WIDTH//2, 0), self.world_width - WIDTH)
+        self.view.x = self.x
+
+    def offset(self, alpha: float) -> int:
+        """
+        前tickと現tickの間を補間した画面左端のx座標を返す
+        引数 alpha：前tickから現tickまでの進み具合（0.0～1.0）
+        """
+        return round(self.prev_x + (self.x-self.prev_x)*alpha)
+
+
+class Level:
+    """
+    チャンクに分けたステージの配置から，画面の近くのチャンクの床・階層・デスこうかとんだけを読み込むクラス
+    画面から離れたチャンクは捨てるので，ステージが長くなっても1tickの処理量は変わらない
+    """
+    def __init__(self, chunks: list[dict], deathks: pg.sprite.Group, margin: int = CHUNK_WIDTH//2):
+        """
+        引数1 chunks：チャンクごとの配置（LEVELと同じ形式）
+        引数2 deathks：読み込んだデスこうかとんを追加するグループ
+        引数3 margin：画面の左右どこまでのチャンクを読み込んでおくか
+        """
+        self.chunks = chunks
+        self.deathks = deathks
+        self.margin = margin
+        self.width = CHUNK_WIDTH * len(chunks)  # ステージ全体の幅
+        self.loaded = {}  # チャンク番号をキーとした（床, 階層のリスト, 配置番号をキーとしたデスこうかとんの辞書）の辞書
+        self.killed = collections.defaultdict(set)  # チャンク番号をキーとした倒したデスこうかとんの配置番号の集合
+        self.floors = []  # 読み込み中の床
+        self.steps = []  # 読み込み中の階層
+        self.platforms = Platforms([])
+        self.area = pg.Rect(0, 0, 0, HEIGHT)  # 読み込み中のチャンクの範囲
+        self.version = 0  # 床・階層の配置が変わるたびに増やす番号（焼き直しの判定用）
+
+    def stream(self, view: pg.Rect) -> bool:
+        """
+        画面の近くのチャンクを読み込み，離れたチャンクを捨てる
+        引数 view：画面に映っている範囲のRect
+        戻り値：読み込み中のチャンクが変わったかどうかの真偽値
+        """
+        first = max((view.left-self.margin)//CHUNK_WIDTH, 0)
+        last = min((view.right-1+self.margin)//CHUNK_WIDTH, len(self.chunks)-1)
+        if list(self.loaded) == list(range(first, last+1)):
+            return False
+        for i in [i for i in self.loaded if not first <= i <= last]:
+            for j, deathk in self.loaded.pop(i)[2].items():
+                if not deathk.alive():  # 倒されたものは読み込み直しても出さない
+                    self.killed[i].add(j)
+                deathk.kill()
+        for i in range(first, last+1):
+            if i not in self.loaded:
+                self.loaded[i] = self.load(i)
+        self.loaded = dict(sorted(self.loaded.items()))
+        self.floors = [floor for floor, _, _ in self.loaded.values()]
+        self.steps = [step for _, steps, _ in self.loaded.values() for step in steps]
+        self.platforms = Platforms(self.floors + self.steps)
+        self.area = pg.Rect(first*CHUNK_WIDTH, 0, (last-first+1)*CHUNK_WIDTH, HEIGHT)
+        self.version += 1
+        return True
+
+    def load(self, i: int) -> tuple[Floor, list[Step], dict[int, "DeathK"]]:
+        """
+        チャンクの床・階層・デスこうかとんを作る．倒したデスこうかとんは作らない
+        引数 i：チャンク番号
+        戻り値：床，階層のリスト，配置番号をキーとしたデスこうかとんの辞書のタプル
+        """
+        x0 = i * CHUNK_WIDTH
+        chunk = self.chunks[i]
+        floor = Floor(x0, CHUNK_WIDTH)
+        steps = [Step(x0+x, y, w, h) for x, y, w, h in chunk.get("steps", [])]
+        deathks = {j: DeathK(x0+x, y, x0+step_x, step_w)
+                   for j, (x, y, step_x, step_w) in enumerate(chunk.get("deathks", [])) if j not in self.killed[i]}
+        self.deathks.add(deathks.values())
+        return floor, steps, deathks
+
+
 class DeathK(pg.sprite.Sprite):
     """
     デスこうかとん（敵キャラ）に関するクラス
     """
     def __init__(self, x, y, step_x, step_width):
         super().__init__()
-        self.images = [pg.image.load("fig/DeathK.png"), pg.transform.flip(pg.image.load("fig/DeathK.png"), True, False)]
-        self.image = self.images[0]
+        self.frames = STRIPS.get("fig/DeathK.png", (True, False))  # 原画と左右反転画像
+        self.frame = 0  # 表示中のコマ番号
+        self.image = self.frames[0]
         self.rect = self.image.get_rect()
         self.rect.topleft = (x, y)
-        self.vx = 2
+        self.vx = 4
         self.step_x = step_x
         self.step_width = step_width
 
@@ -325,7 +1028,44 @@ class DeathK(pg.sprite.Sprite):
         self.rect.x += self.vx
         if self.rect.left <= self.step_x or self.rect.right >= self.step_x + self.step_width:
             self.vx = -self.vx
-            self.image = pg.transform.flip(self.image, True, False)
+            self.frame ^= 1  # 向きを反転
+            self.image = self.frames[self.frame]
+
+class HudText:
+    """
+    「ラベル＋数値」の文字列画像を，数値が変わったときだけ作り直すクラス
+    数字は事前に描画した0～9の画像を並べて合成する
+    """
+    def __init__(self, font: pg.font.Font, label: str, color: tuple[int, int, int]):
+        """
+        ラベルと数字の画像を描画しておく
+        引数1 font：使用するフォント
+        引数2 label：数値の前に表示する文字列
+        引数3 color：文字色
+        """
+        self.label = font.render(label, 0, color)
+        self.glyphs = {c: font.render(c, 0, color) for c in "0123456789-"}
+        self.value = None  # 現在の画像に描かれている数値
+        self.image = None
+
+    def render(self, value: int) -> pg.Surface:
+        """
+        数値を表す文字列画像を返す．数値が変わったときだけ合成し直す
+        引数 value：表示する数値
+        戻り値：文字列画像Surface
+        """
+        if value != self.value:
+            parts = [self.label] + [self.glyphs[c] for c in str(value)]
+            width = sum(part.get_width() for part in parts)
+            height = max(part.get_height() for part in parts)
+            self.image = pg.Surface((width, height), pg.SRCALPHA)
+            x = 0
+            for part in parts:
+                self.image.blit(part, (x, 0))
+                x += part.get_width()
+            self.value = value
+        return self.image
+
 
 class Life:
     """
@@ -334,14 +1074,22 @@ class Life:
     def __init__(self, color: tuple[int, int, int]):
         self.valu = 10
         self.fonto = pg.font.SysFont("hgp創英角ﾎﾟｯﾌﾟ体", 30)
+        self.hud = HudText(self.fonto, "ライフ ", (100, 255, 255))
         self.img = self.fonto.render(f"ライフ {self.valu}", 0, (0, 255, 100))
         self.rct = self.img.get_rect()
         self.rct.center = 60, 20
 
 
+    def render(self) -> pg.Surface:
+        """
+        残りライフの画像を返す（値が変わったときだけ作り直す）
+        戻り値：残りライフの画像Surface
+        """
+        self.img = self.hud.render(self.valu)
+        return self.img
+
     def update(self, screen:pg.Surface):
-       self.img = self.fonto.render(f"ライフ {self.valu}", 0, (100, 255, 255))
-       screen.blit(self.img, self.rct)
+        screen.blit(self.render(), self.rct)
 
 
 def game_start(screen: pg.Surface):
@@ -368,7 +1116,7 @@ def game_clear(screen: pg.Surface):
     """
     ゲームクリア時に、「Game Clear」と表示
     """
-    bg_img_n8 = pg.image.load("fig/8.png")  # こうかとん画像ロード
+    bg_img_n8 = ASSETS.load("fig/8.png")  # こうかとん画像ロード
     fonto = pg.font.Font(None, 100)
     txt = fonto.render("Game Clear", True, (255, 255, 255))
     game_clear = pg.Surface((WIDTH, HEIGHT))
@@ -380,14 +1128,13 @@ def game_clear(screen: pg.Surface):
     screen.blit(bg_img_n8, [WIDTH/2+200, HEIGHT/2])
     print("kansujikkou")
     pg.display.update()
-    time.sleep(5)
 
 def game_over(screen: pg.Surface) -> None:
     """
     ゲームオーバー時に、半透明の黒い画面上で「Game Over」と表示し、
     泣いているこうかとん画像を張り付ける
     """
-    bg_img_n8 = pg.image.load("fig/8.png")  # こうかとん画像ロード
+    bg_img_n8 = ASSETS.load("fig/8.png")  # こうかとん画像ロード
     fonto = pg.font.Font(None, 100)
     txt = fonto.render("Game Over", True, (255, 255, 255))
     game_over = pg.Surface((WIDTH, HEIGHT))
@@ -399,24 +1146,28 @@ def game_over(screen: pg.Surface) -> None:
     screen.blit(bg_img_n8, [WIDTH/2+200, HEIGHT/2])
     print("kansujikkou")
     pg.display.update()
-    time.sleep(5)
 
 class Flying_enemy(pg.sprite.Sprite):
     """
     飛ぶ敵に関するクラス
     """
-    imgs = [pg.image.load(f"fig/alien{i}.png") for i in range(1, 4)]
+    imgs = [f"fig/alien{i}.png" for i in range(1, 4)]  # 敵機画像ファイル名
     
-    def __init__(self):
+    def __init__(self, rng: random.Random = random, area: pg.Rect | None = None):
+        """
+        引数1 rng：乱数生成器
+        引数2 area：出現して左右に往復する範囲のRect（None：ステージ左端の1画面分）
+        """
         super().__init__()
-        self.image = pg.transform.rotozoom(random.choice(__class__.imgs), 0, 0.8)
+        self.area = area if area is not None else pg.Rect(0, 0, WIDTH, HEIGHT)
+        self.image = STRIPS.get(rng.choice(__class__.imgs), zoom=0.8)[0]
         self.rect = self.image.get_rect()
-        self.rect.center = random.randint(100, WIDTH-100), 0
-        self.vx = random.choice([-4, 4])  # 左右方向の初期速度（ランダムで左か右に動く）
+        self.rect.center = rng.randint(self.area.left+100, self.area.right-100), 0
+        self.vx = rng.choice([-4, 4])  # 左右方向の初期速度（ランダムで左か右に動く）
         self.vy = +6
-        self.bound = random.randint(50, HEIGHT // 2)  # 停止位置
+        self.bound = rng.randint(50, HEIGHT // 2)  # 停止位置
         self.state = "down"  # 降下状態 or 停止状態
-        self.interval = random.randint(200, 300)  # 爆弾投下インターバル
+        self.interval = rng.randint(200, 300)  # 爆弾投下インターバル
         self.timer = 0  # 爆弾投下用のタイマー
 
     def update(self):
@@ -435,7 +1186,7 @@ class Flying_enemy(pg.sprite.Sprite):
             self.rect.x += self.vx
 
         # 画面端で反転させる
-        if self.rect.left <= 0 or self.rect.right >= WIDTH:
+        if self.rect.left <= self.area.left or self.rect.right >= self.area.right:
             self.vx *= -1  # 移動方向を反転
 
         self.timer += 1
@@ -444,13 +1195,16 @@ class Boss(pg.sprite.Sprite):
     """
     ボスに関するクラス
     """
-    boss_img = pg.image.load("fig/boss.png")
 
-    def __init__(self):
+    def __init__(self, area: pg.Rect | None = None):
+        """
+        引数 area：ボスが動き回る範囲のRect（None：ステージ左端の1画面分）
+        """
         super().__init__()
-        self.image = pg.transform.rotozoom(__class__.boss_img, 0, 0.6)
+        self.area = area if area is not None else pg.Rect(0, 0, WIDTH, HEIGHT)
+        self.image = STRIPS.get("fig/boss.png", zoom=0.6)[0]
         self.rect = self.image.get_rect() # ボスのRect
-        self.rect.center = (WIDTH // 2, -500)  # 初期位置は画面上部外
+        self.rect.center = (self.area.centerx, self.area.top-500)  # 初期位置は画面上部外
         self.vx, self.vy = 5, 5  # ボスの移動速度
         self.state = "down"  # 初期状態
         self.hp = 50  # ボスの体力
@@ -464,10 +1218,10 @@ class Boss(pg.sprite.Sprite):
             # ボスが画面内に入る
             self.rect.y += self.vy
             
-            if self.rect.top >= 0:  # 画面内に入ったら移動状態に変更
+            if self.rect.top >= self.area.top:  # 画面内に入ったら移動状態に変更
                 self.rect.x += self.vx
                 self.vy = 0
-                if self.rect.right >= (WIDTH):
+                if self.rect.right >= self.area.right:
                     self.vx = 0
                     self.state = "move"
                     self.vx = -8
@@ -477,14 +1231,14 @@ class Boss(pg.sprite.Sprite):
             # ボスが画面内を移動
             self.rect.x += self.vx
             self.rect.y += self.vy
-            if self.rect.right >= WIDTH:  # 横方向の反転
+            if self.rect.right >= self.area.right:  # 横方向の反転
                 self.vx *= -1
-            elif self.rect.left <= 0:  # 横方向の反転
+            elif self.rect.left <= self.area.left:  # 横方向の反転
                 self.vx *= -1
 
-            if self.rect.bottom >= HEIGHT:  # 縦方向の反転
+            if self.rect.bottom >= self.area.bottom:  # 縦方向の反転
                 self.vy *= -1
-            elif self.rect.top <= 0: # 縦方向の反転
+            elif self.rect.top <= self.area.top: # 縦方向の反転
                 self.vy *= -1
             
 
@@ -503,40 +1257,28 @@ class Boss(pg.sprite.Sprite):
                 self.attack_timer = 0
                 self.state = "move"
 
-class BossBomb(pg.sprite.Sprite):
+class BossBomb:
     """
-    爆弾に関するクラス
+    ボスが撃つ爆弾の種類（弾そのものはBulletsでまとめて管理する）
     """
     colors = [(255, 0, 0), (255, 32, 0),(255, 64, 0), (255, 96, 0), (255, 128, 0), (255, 160, 0), (255, 192, 0), (255, 224, 0), (255, 255, 0)]
+    rad = 20  # 爆弾円の半径
+    speed = 8
 
-    def __init__(self, boss: "Boss", bird: Bird):
+    @staticmethod
+    def spawn(bullets: Bullets, boss: "Boss", bird: Bird, rng: random.Random = random):
         """
-        爆弾円Surfaceを生成する
-        引数1 emy：爆弾を投下する敵機
-        引数2 bird：攻撃対象のこうかとん
+        ボスの中心からこうかとんに向けて爆弾を1個撃つ
+        引数1 bullets：爆弾を追加する弾の集まり
+        引数2 boss：爆弾を撃つボス
+        引数3 bird：攻撃対象のこうかとん
+        引数4 rng：乱数生成器
         """
-        super().__init__()
-        rad = 20 # 爆弾円の半径
-        self.image = pg.Surface((2*rad, 2*rad)) # 爆弾円のSurface
-        color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
-        self.rect = self.image.get_rect()
-        # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
-        self.vx, self.vy = calc_orientation(boss.rect, bird.rect)  # birdへの方向ベクトル
-        self.rect.centerx = boss.rect.centerx  # 爆弾の初期位置
-        self.rect.centery = boss.rect.centery # 爆弾の初期位置
-        self.speed = 8
+        color = rng.randrange(len(__class__.colors))  # 爆弾円の色：クラス変数からランダム選択
+        vx, vy = calc_orientation(boss.rect, bird.rect)  # birdへの方向ベクトル
+        bullets.spawn(boss.rect.center, (__class__.speed*vx, __class__.speed*vy), __class__.rad, color)
+
 
-    def update(self):
-        """
-        爆弾を速度ベクトルself.vx, self.vyに基づき移動させる
-        引数 screen：画面Surface
-        """
-        self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
-        if check_bound(self.rect) != (True, True):
-            self.kill()
-            
 class Score:
     """
     打ち落とした爆弾，敵機の数をスコアとして表示するクラス
@@ -547,228 +1289,1066 @@ class Score:
         self.font = pg.font.Font(None, 50)
         self.color = (0, 0, 255)
         self.value = 0
-        self.image = self.font.render(f"Score: {self.value}", 0, self.color)
+        self.hud = HudText(self.font, "Score: ", self.color)
+        self.image = self.hud.render(self.value)
         self.rect = self.image.get_rect()
         self.rect.center = 100, HEIGHT-50
 
+    def render(self) -> pg.Surface:
+        """
+        スコアの画像を返す（値が変わったときだけ作り直す）
+        戻り値：スコアの画像Surface
+        """
+        self.image = self.hud.render(self.value)
+        return self.image
+
     def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Score: {self.value}", 0, self.color)
-        screen.blit(self.image, self.rect)
-
-def main():
-    pg.display.set_caption("こうかとんの村")
-    SCREEN_FLAG = False
-    pg.display.set_caption("title")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    bg_img = pg.image.load(f"fig/Game-battle-background-1024x576.png")
-    screen.blit(bg_img, [0, 0])
-    game_start(screen)  # タイトル画面の関数を呼び出し
-    pg.display.update()
-        
-    while SCREEN_FLAG == False:  # Falseのときタイトル画面
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return 0
-            if event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:  # エスケープキーが押されたら
-                SCREEN_FLAG = True  # 画面状態をTrueにする
-                pg.quit
-
-    if SCREEN_FLAG == True:  # 画面状態がTrueならゲーム画面を表示
-        pg.display.set_caption("こうかとんの村")
-        screen = pg.display.set_mode((WIDTH, HEIGHT))
-        bg_img = pg.image.load(f"fig/Game-battle-background-1024x576.png")
-
-        bird = Bird(3, (550, 300)) 
-        beams = pg.sprite.Group()
-        bombs = pg.sprite.Group()
-        emys = pg.sprite.Group()
-        flying_enemy = pg.sprite.Group()
-        exps = pg.sprite.Group()
-        floor = Floor()
-        step1 = Step(00,  400, 300, 20) #床の位置を設定
-        step2 = Step(800, 400, 300, 20)
-        step3 = Step(00, 200, 300, 20)
-        step4 = Step(800, 200, 300, 20)
-        step5 = Step(450, 300, 200, 20 )
-        deathk1 = DeathK(0, 330, 0, 300)  # step1の上を徘徊するデスこうかとん
-        deathk2 = DeathK(800, 330, 800, 300)  # step2の上を徘徊するデスこうかとん
-        deathk3 = DeathK(0, 500, 0, 1100)
-        deathks = pg.sprite.Group(deathk1, deathk2,deathk3)
-
-        l_scr = Life((0, 255, 255))  # 残りライフ
-
-        boss = Boss() # ボス
-        bossbombs = pg.sprite.Group()
-
-        score = Score()  # スコア
-
-        tmr = 0
-        clock = pg.time.Clock()
-        while True:
-            key_lst = pg.key.get_pressed()
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    return 0
-                if event.type == pg.KEYDOWN and event.key == pg.K_RETURN:
-                    beams.add(Beam(bird))
-                
-                
-            if (tmr%350 == 0) and (len(flying_enemy) < 3):  # 350フレームに1回,敵機を出現させ,上限を3体までにする
-                new_enemy = Flying_enemy()
-                flying_enemy.add(new_enemy)
-                emys.add(new_enemy)  # 敵機を emys にも追加
-                #flying_enemy.add(Flying_enemy())
-            elif score.value >= 50: # 50点以上になったらボスを出現させる
-                boss.update(tmr)
-
-
-            for emy in emys:
-                if emy.timer >= emy.interval:  # 200フレームごとに爆弾を投下
-                    bombs.add(Bomb(emy, bird))
-                    emy.timer = 0  # タイマーをリセット
-
-            for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():  # ビームと衝突した敵機リスト
-                exps.add(Explosion(emy, 100))  # 爆発エフェクト
-                score.value += 10  # スコアを10点加算
-                bird.change_img(6, screen)  # こうかとん喜びエフェクト
-
-            if pg.sprite.spritecollide(bird, bombs, True) and bird.state == "normal":  # こうかとんと衝突した爆弾リスト
-                #こうかとんに弾が当たったらライフを1減らす
-                l_scr.valu-=1
-                bird.state = "hyper"
-                bird.hyper_life = 100
-                if l_scr.valu == 0:
-                    game_over(screen)
-                    return
-                
-
-            screen.blit(bg_img, [0, 0]) # 背景画像描画
-            #if 敵に当たる、攻撃が当たったら:
-            #l_scr.valu-=1  残りライフを1減らす
+        screen.blit(self.render(), self.rect)
 
-            
-            if l_scr.valu <= 0:  # ライフが0なら
-                game_over(screen)  # ゲームオーバー
-                return
-
-            bird.update(key_lst, screen)
-            if bird.velocity_y >= 0:
-                if floor.check_collision(bird.rect):
-                    bird.rect.y = floor.rect.top - bird.rect.height  # 衝突時にこうかとんを床の上に移動
-                    bird.flooting = True
-                elif step1.check_collision(bird.rect):
-                    bird.rect.y = step1.rect.top - bird.rect.height # 衝突時にこうかとんを床の上に移動
-                    bird.flooting = True
-                elif step2.check_collision(bird.rect):
-                    bird.rect.y = step2.rect.top - bird.rect.height    # 衝突時にこうかとんを床の上に移動 
-                    bird.flooting = True
-                elif step3.check_collision(bird.rect):
-                    bird.rect.y = step3.rect.top - bird.rect.height # 衝突時にこうかとんを床の上に移動
-                    bird.flooting = True
-                elif step4.check_collision(bird.rect):
-                    bird.rect.y = step4.rect.top - bird.rect.height # 衝突時にこうかとんを床の上に移動
-                    bird.flooting = True
-                elif step5.check_collision(bird.rect):
-                    bird.rect.y = step5.rect.top - bird.rect.height # 衝突時にこうかとんを床の上に移動
-                    bird.flooting = True
-                else:
-                    bird.flooting = False
-            # else:
-            #     bird.flooting = False
-
-            if pg.sprite.spritecollideany(bird, deathks) and bird.state == "normal":
-                l_scr.valu-=1
-                bird.state = "hyper"
-                bird.hyper_life = 100
-                  # こうかとんがデスこうかとんに触れたらゲームを終了
-                if l_scr.valu <= 0: #ライフが0以下なら
-                    game_over(screen)
-                    return
-            
-            collisions = pg.sprite.groupcollide( beams,deathks, True, True)  # 敵機とビームの衝突リスト
-            if collisions:
-                for deathk in collisions.values():
-                    for d in deathk:
-                        d.kill()
-            
-            # ボスの生成
-        
-            screen.blit(boss.image, boss.rect)
-            
+class Stage:
+    """
+    背景画像と床・階層を，読み込み中のチャンク全体の横長の一枚のSurfaceに焼き込んだステージ画像に関するクラス
+    チャンクの読み込みが変わったときだけ焼き直し，描画時は視点に合わせて画面分を切り出す
+    """
+    def __init__(self, bg_img: pg.Surface, level: Level):
+        """
+        引数1 bg_img：画面と同じ大きさの背景画像Surface（Assets.scaledで作る）
+        引数2 level：床・階層を読み込んでいるステージ
+        """
+        self.bg_img = bg_img
+        self.level = level
+        self.image = None  # 読み込み中のチャンク全体（level.area）のステージ画像
+        self.left = 0  # ステージ画像の左端のx座標
+        self.version = None  # 焼き込み済みの床・階層の配置の番号
+        self.bake()
+
+    def bake(self) -> bool:
+        """
+        読み込み中のチャンクが変わっていればステージ画像を焼き直す
+        戻り値：焼き直したかどうかの真偽値
+        """
+        if self.version == self.level.version:  # 配置の変化はLevel.stream()が番号で知らせる
+            return False
+        area = self.level.area
+        if self.image is None or self.image.get_size() != area.size:
+            self.image = pg.Surface(area.size)
+            if pg.display.get_surface() is not None:
+                self.image = self.image.convert()
+        bg_w = self.bg_img.get_width()
+        for x in range(-(area.left % bg_w), area.width, bg_w):  # 背景はステージの左端から敷き詰める
+            self.image.blit(self.bg_img, [x, 0])
+        for plat in self.level.floors + self.level.steps:
+            plat.update(self.image, area.left)
+        self.left = area.left
+        self.version = self.level.version
+        return True
+
+    def view(self, cam_x: int) -> pg.Rect:
+        """
+        画面に映る範囲をステージ画像上の矩形で返す
+        引数 cam_x：画面左端のx座標
+        """
+        return pg.Rect(cam_x - self.left, 0, WIDTH, HEIGHT)
 
-            if boss.state == "attack" and tmr % 2 == 0:  # 攻撃状態で2フレームごとに爆弾を
-                bossbombs.add(BossBomb(boss, bird))
-            for bomb in pg.sprite.groupcollide(bossbombs, beams, True, True).keys():  # ビームと衝突した爆弾リスト
-                exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            #こうかとんが弾と衝突したら
-            if pg.sprite.spritecollide(bird, bossbombs, True) and score.value >= 50 and bird.state == "normal":
-                l_scr.valu-=1
-                bird.state = "hyper"
-                bird.hyper_life = 100
-                if l_scr.valu <= 0: #ライフが0以下なら
-                    game_over(screen)
-                    return
-            #bossがこうかとんと衝突したら
-            if boss.rect.colliderect(bird.rect) and score.value >= 50 and bird.state == "normal":
-                l_scr.valu-=1
-                bird.state = "hyper"
-                bird.hyper_life = 100
-                if l_scr.valu <= 0:
-                    game_over(screen)
-                    return
-            
-            #bossとビームが衝突したら
-            if pg.sprite.spritecollide(boss, beams, True) and score.value >= 50:    
-                boss.hp -= 1
-                if boss.hp <= 0:
-                    game_clear(screen)  # ゲームクリア
-                    game_clear(screen)
-                    return
-                    #print("GAME CLEAR")
-                    #return
-    
-            bossbombs.update()
-            bossbombs.draw(screen)
-            l_scr.update(screen)  # 残りライフ
-            beams.update()
-            beams.draw(screen)
-            exps.update()
-            exps.draw(screen)
-            floor.update(screen)
-            step1.update(screen)
-            step2.update(screen)
-            step3.update(screen)
-            step4.update(screen)
-            step5.update(screen)
-            deathk1.update()
-            deathk2.update()
-            deathk3.update()
-            deathks.update()
-            deathks.draw(screen)
-            bird.update(key_lst, screen)
-            bombs.update()
-            bombs.draw(screen)
-            flying_enemy.update()
-            flying_enemy.draw(screen)
-            l_scr.update(screen)  # 残りライフ
+
+class DirtyRects:
+    """
+    描画する画像を奥から順にためて1回のblitsでまとめて描画し，変化した領域だけを画面に反映するクラス
+    無効の場合は毎フレーム背景全体を描画し，画面全体を更新する
+    """
+    def __init__(self, stage: Stage, enabled: bool = False):
+        """
+        引数1 stage：消去に使うステージ画像
+        引数2 enabled：差分更新を行うか
+        """
+        self.stage = stage
+        self.enabled = enabled
+        self.prev = []  # 前フレームで描画した矩形のリスト
+        self.rects = []  # 今フレームで描画した矩形のリスト
+        self.full = True  # 次のフレームで画面全体を描画・更新するか
+        self.culled = 0  # 今フレームで画面外のため描画しなかった数
+        self.cam_x = None  # 前フレームの画面左端のx座標
+        self.queue = []  # 今フレームで描画する（画像, 左上座標）のリスト（奥から順）
+
+    def erase(self, screen: pg.Surface, cam_x: int = 0):
+        """
+        前フレームで描画した領域をステージ画像で塗りつぶす
+        引数1 screen：画面Surface
+        引数2 cam_x：画面左端のx座標
+        """
+        self.culled = 0
+        if self.stage.bake() or cam_x != self.cam_x:  # チャンクか視点が変わったら画面全体を描き直す
+            self.full = True
+            self.cam_x = cam_x
+        view = self.stage.view(cam_x)
+        if self.full:
+            screen.blit(self.stage.image, [0, 0], view)
+            return
+        for rct in self.prev:
+            screen.blit(self.stage.image, rct, rct.move(view.x, 0))
+
+    def add(self, img: pg.Surface, rct: pg.Rect):
+        """
+        画像を描画待ちに加える
+        引数1 img：描画する画像Surface
+        引数2 rct：描画位置のRect（左上座標を使う）
+        """
+        self.queue.append((img, rct.topleft))
+
+    def add_sprites(self, sprites, alpha: float, cam_x: int = 0):
+        """
+        画面に映るスプライトだけを補間位置で描画待ちに加える
+        引数1 sprites：スプライトのグループまたはリスト
+        引数2 alpha：前tickから現tickまでの進み具合（0.0～1.0）
+        引数3 cam_x：画面左端のx座標
+        """
+        sw, sh = WIDTH, HEIGHT
+        queue = self.queue
+        culled = 0
+        for spr in sprites:
+            img = spr.image
+            x, y = lerp_xy(spr, alpha)
+            x -= cam_x
+            if x >= sw or y >= sh or x+img.get_width() <= 0 or y+img.get_height() <= 0:  # 画面外なら描画しない
+                culled += 1
+            else:
+                queue.append((img, (x, y)))
+        self.culled += culled
+
+    def add_bullets(self, bullets: Bullets, alpha: float, cam_x: int = 0):
+        """
+        画面に映る弾だけを補間位置で描画待ちに加える
+        引数1 bullets：弾の集まり
+        引数2 alpha：前tickから現tickまでの進み具合（0.0～1.0）
+        引数3 cam_x：画面左端のx座標
+        """
+        seq, culled = bullets.blit_list(alpha, cam_x, (WIDTH, HEIGHT))
+        self.queue += seq
+        self.culled += culled
+
+    def render(self, screen: pg.Surface):
+        """
+        描画待ちの画像を1回の呼び出しでまとめて描画し，描画した矩形を記録する
+        引数 screen：画面Surface
+        """
+        if self.enabled:
+            self.rects += screen.blits(self.queue)
+        elif hasattr(screen, "fblits"):  # 矩形が要らなければ速い方を使う（pygame-ce）
+            screen.fblits(self.queue)
+        else:
+            screen.blits(self.queue, False)
+        self.queue = []
+
+    def flush(self):
+        """
+        前フレームと今フレームの矩形だけを画面に反映する
+        """
+        if self.full:
             pg.display.update()
-            tmr += 1
-            clock.tick(50)
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
+            self.full = not self.enabled
+        else:
+            pg.display.update(self.prev + self.rects)
+        self.prev, self.rects = self.rects, []
+
+
+class Profiler:
+    """
+    1フレームの処理時間を段階ごとに計測し，直近のフレームのp50/p95/最大値を表示するクラス
+    """
+    stages = ["input", "wait", "ai", "physics", "collision", "draw", "flip"]  # 計測する段階
+
+    def __init__(self, window: int = 150, csv_path: str | None = None):
+        """
+        引数1 window：p50/p95/最大値を求める直近のフレーム数
+        引数2 csv_path：フレームごとの計測結果を書き出すCSVファイル名
+        """
+        self.hist = {stage: collections.deque(maxlen=window) for stage in __class__.stages + ["total"]}
+        self.cur = dict.fromkeys(__class__.stages, 0.0)  # 今フレームの段階ごとの処理時間[秒]
+        self.start = self.last = time.perf_counter()
+        self.frame = 0
+        self.counts = {}  # グループごとのスプライト数
+        self.pacing = "full"  # フレームの進め方（full／paused／background／idle）
+        self.visible = False  # 画面に表示するか
+        self.font = None
+        self.image = None
+        self.rect = None
+        self.csv_file = open(csv_path, "w", newline="") if csv_path else None
+        self.writer = csv.writer(self.csv_file) if self.csv_file else None
+        self.columns = None  # CSVに書き出している個数の項目
+
+    def begin_frame(self):
+        """
+        フレームの計測を始める
+        """
+        self.cur = dict.fromkeys(__class__.stages, 0.0)
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, stage: str):
+        """
+        前回の記録から今までの時間を段階stageの処理時間に加える
+        引数 stage：段階名
+        """
+        now = time.perf_counter()
+        self.cur[stage] += now - self.last
+        self.last = now
+
+    def end_frame(self, counts: dict[str, int], pacing: str = "full"):
+        """
+        フレームの計測を終え，履歴とCSVに記録する
+        引数1 counts：グループごとのスプライト数（描画時は画面外のため描画しなかった数も含む）
+        引数2 pacing：このフレームの進め方（full／paused／background／idle）
+        """
+        total = time.perf_counter() - self.start
+        for stage, sec in self.cur.items():
+            self.hist[stage].append(sec*1000)
+        self.hist["total"].append(total*1000)
+        if self.writer is not None:
+            if list(counts) != self.columns:  # 画面が変わって個数の項目が変わったら見出し行を書き直す
+                self.columns = list(counts)
+                self.writer.writerow(["frame", "pacing"] + __class__.stages + ["total"] + self.columns)
+            ms = [f"{self.cur[stage]*1000:.3f}" for stage in __class__.stages]
+            self.writer.writerow([self.frame, pacing] + ms + [f"{total*1000:.3f}"] + list(counts.values()))
+        self.counts = counts
+        self.pacing = pacing
+        self.frame += 1
+
+    def summary(self) -> dict[str, tuple[float, float, float]]:
+        """
+        段階ごとの直近の処理時間のp50，p95，最大値[ms]を返す
+        """
+        result = {}
+        for stage, hist in self.hist.items():
+            if hist:
+                ms = sorted(hist)
+                result[stage] = ms[len(ms)//2], ms[min(len(ms)-1, len(ms)*95//100)], ms[-1]
+        return result
+
+    def toggle(self):
+        """
+        画面表示を切り替える
+        """
+        self.visible = not self.visible
+
+    def render(self) -> pg.Surface:
+        """
+        画面右上に表示する計測結果の画像を返す．画像は25フレームごとに作り直す
+        """
+        if self.image is None or self.frame % 25 == 0:
+            if self.font is None:
+                self.font = pg.font.Font(None, 22)
+            lines = ["stage       p50    p95    max [ms]"]
+            for stage, (p50, p95, peak) in self.summary().items():
+                lines.append(f"{stage:<10}{p50:6.2f} {p95:6.2f} {peak:6.2f}")
+            lines.append(f"pacing: {self.pacing}")
+            lines += [f"{name}: {num}" for name, num in self.counts.items()]
+            imgs = [self.font.render(line, True, (255, 255, 255)) for line in lines]
+            self.image = pg.Surface((max(img.get_width() for img in imgs)+10, 18*len(imgs)+10))
+            self.image.set_alpha(192)
+            for i, img in enumerate(imgs):
+                self.image.blit(img, (5, 5+18*i))
+            self.rect = self.image.get_rect(topright=(WIDTH-5, 5))
+        return self.image
+
+    def close(self):
+        """
+        CSVファイルを閉じる
+        """
+        if self.csv_file is not None:
+            self.csv_file.close()
+
+
+class Scheduler:
+    """
+    1tickの更新処理を段階ごとに登録し，段階順に1回ずつ呼び出すクラス
+    段階は ai（出現・敵の動き）→ physics（移動・重力・着地）の順で，当たり判定と描画はその後に行う
+    同じ対象を2回登録したときは例外を送出する．check=Trueのときは，スプライトとそれを含むグループを
+    両方登録して1tickに2回動くスプライトがあったときも例外を送出する（毎tick全スプライトを調べるので開発用）
+    """
+    phases = ["ai", "physics"]
+
+    def __init__(self, check: bool = False):
+        """
+        引数 check：1tickに2回更新されるスプライトを毎tick調べるか
+        """
+        self.check_updates = check
+        self.jobs = {phase: [] for phase in __class__.phases}  # 段階ごとの（対象, 呼び出す関数）のリスト
+        self.owners = {}  # 登録済みの対象のid：（段階，対象）
+        self.updated = set()  # 今tickに更新したスプライト
+
+    def add(self, phase: str, target, func=None):
+        """
+        対象の更新処理を段階の最後に登録する
+        引数1 phase：段階名
+        引数2 target：更新する対象（スプライト，グループ，弾の集まり，スプライトを動かさない処理など）
+        引数3 func：引数なしで呼び出す更新処理（None：target.update）
+        """
+        if phase not in self.jobs:
+            raise ValueError(f"段階 {phase} はありません")
+        if id(target) in self.owners:
+            raise ValueError(f"{target!r} は段階 {self.owners[id(target)][0]} に登録済みです")
+        self.owners[id(target)] = phase, target  # 対象を持っておき，idの使い回しを防ぐ
+        self.jobs[phase].append((target, target.update if func is None else func))
+
+    def run(self, phase: str):
+        """
+        段階に登録した更新処理を登録順に1回ずつ呼び出す（最初の段階で新しいtickとみなす）
+        引数 phase：段階名
+        """
+        if not self.check_updates:
+            for _, func in self.jobs[phase]:
+                func()
+            return
+        if phase == __class__.phases[0]:
+            self.updated = set()
+        for target, func in self.jobs[phase]:
+            self.check(target)
+            func()
+
+    def check(self, target):
+        """
+        対象が更新するスプライトを記録し，今tickに更新済みのものがあれば例外を送出する
+        引数 target：更新する対象
+        """
+        if isinstance(target, pg.sprite.Sprite):
+            sprites = [target]
+        elif isinstance(target, pg.sprite.AbstractGroup):
+            sprites = target.sprites()
+        else:  # 弾の集まりやカメラなど，スプライトを持たない対象
+            return
+        for spr in sprites:
+            if spr in self.updated:
+                raise RuntimeError(f"{spr!r} が1tickに2回更新されます（{target!r} と別の対象に重複して登録）")
+            self.updated.add(spr)
+
+
+class Game:
+    """
+    プレイ中のゲーム状態（こうかとん，敵，弾，ステージ，ライフ，スコア）をまとめて管理するクラス
+    """
+    def __init__(self, seed: int | None = None, prof: "Profiler | None" = None, chunks: list[dict] = LEVEL,
+                 check_updates: bool = False):
+        """
+        引数1 seed：敵や爆弾の出現に使う乱数の種（None：毎回異なる）
+        引数2 prof：処理段階ごとの計測器（None：計測結果を表示しない計測器を作る）
+        引数3 chunks：チャンクごとのステージの配置
+        引数4 check_updates：1tickに2回更新されるスプライトがないか毎tick調べるか（開発用）
+        """
+        self.rng = random.Random(seed)  # 全ての出現処理で共有する乱数生成器
+        self.prof = prof if prof is not None else Profiler()
+        self.bird = Bird(3, (550, 300)) 
+        self.beams = pg.sprite.Group()
+        self.bombs = Bullets(Bomb.colors)
+        self.emys = pg.sprite.Group()
+        self.flying_enemy = pg.sprite.Group()
+        self.exps = pg.sprite.Group()
+        self.deathks = pg.sprite.Group()
+        self.level = Level(chunks, self.deathks)  # 床・階層・デスこうかとんは画面の近くのチャンクだけ読み込む
+        self.camera = Camera(self.level.width)
+        self.camera.follow(self.bird.rect)
+        self.camera.prev_x = self.camera.x
+        self.level.stream(self.camera.view)
+        self.bird.area = pg.Rect(0, 0, self.level.width, HEIGHT)
+
+        self.l_scr = Life((0, 255, 255))  # 残りライフ
+
+        self.boss = Boss(pg.Rect(self.level.width-WIDTH, 0, WIDTH, HEIGHT)) # ボス（ステージ右端の1画面で戦う）
+        self.bossbombs = Bullets(BossBomb.colors, 1024)
+
+        self.score = Score()  # スコア
+        self.beam_pool = Pool(Beam, 64)  # 弾・爆発エフェクトの使い回し
+        self.exp_pool = Pool(Explosion, 64)
+        self.beam_grid = SpatialHash(self.beams)  # 衝突判定の絞り込み
+        self.deathk_grid = SpatialHash(self.deathks)
+        bg_img = ASSETS.scaled("fig/Game-battle-background-1024x576.png", (WIDTH, HEIGHT))  # 画面の大きさに合わせる
+        self.stage = Stage(bg_img, self.level)  # 背景と床・階層
+        self.tmr = 0
+        self.key_lst = collections.defaultdict(bool)  # 今tickの押下キー
+
+        self.sched = Scheduler(check_updates)  # 全ての対象を1tickに1回ずつ動かす
+        self.sched.add("ai", self.spawn, self.spawn)  # 出現と爆弾投下（スプライトは動かさない）
+        self.sched.add("ai", self.boss, lambda: self.score.value >= 50 and self.boss.update(self.tmr))  # 50点以上になったらボスを出現させる
+        self.sched.add("ai", self.flying_enemy)
+        self.sched.add("ai", self.deathks)
+        self.sched.add("physics", self.bird, self.move_bird)
+        self.sched.add("physics", self.beams, lambda: self.beams.update(self.camera.view))
+        self.sched.add("physics", self.bombs, lambda: self.bombs.update(self.camera.view))
+        self.sched.add("physics", self.bossbombs, lambda: self.bossbombs.update(self.camera.view))
+        self.sched.add("physics", self.exps)
+        self.sched.add("physics", self.camera, self.scroll)
+
+    def land(self, bird: Bird):
+        """
+        落下中のこうかとんが床・階層に触れていれば，その上に立たせる
+        触れているものが複数あれば，床，階層の順で先にあるものの上に乗せる
+        引数 bird：こうかとん
+        """
+        if bird.velocity_y >= 0:
+            plat = self.level.platforms.find(bird.rect)
+            if plat is not None:
+                bird.rect.y = plat.rect.top - bird.rect.height  # 衝突時にこうかとんを床の上に移動
+                bird.flooting = True
+            else:
+                bird.flooting = False
+
+    def fire(self):
+        """
+        こうかとんの向きにビームを発射する
+        """
+        self.beams.add(self.beam_pool.get(self.bird))
 
+    def spawn(self):
+        """
+        敵機を出現させ，敵機とボスに爆弾を撃たせる
+        """
+        bird, emys, flying_enemy = self.bird, self.emys, self.flying_enemy
+        if (self.tmr%350 == 0) and (len(flying_enemy) < 3):  # 350フレームに1回,敵機を出現させ,上限を3体までにする
+            new_enemy = Flying_enemy(self.rng, self.camera.view.copy())  # 今映っている範囲に出現させる
+            flying_enemy.add(new_enemy)
+            emys.add(new_enemy)  # 敵機を emys にも追加
+
+        for emy in emys:
+            if emy.timer >= emy.interval:  # 200フレームごとに爆弾を投下
+                Bomb.spawn(self.bombs, emy, bird, self.rng)
+                emy.timer = 0  # タイマーをリセット
+
+        if self.boss.state == "attack" and self.tmr % 2 == 0:  # 攻撃状態で2フレームごとに爆弾を
+            BossBomb.spawn(self.bossbombs, self.boss, bird, self.rng)
+
+    def move_bird(self):
+        """
+        押下キーに応じてこうかとんを動かし，床・階層に着地させる
+        """
+        self.bird.update(self.key_lst)
+        self.land(self.bird)
+
+    def scroll(self):
+        """
+        こうかとんを追ってカメラを動かし，ステージのチャンクを読み込み直す
+        """
+        self.camera.follow(self.bird.rect)
+        self.level.stream(self.camera.view)
+        for emy in self.flying_enemy.sprites():
+            if not self.level.area.colliderect(emy.rect):  # 読み込み範囲から外れた敵機は消す
+                emy.kill()
+
+    def hit_bird(self) -> bool:
+        """
+        無敵状態でないこうかとんのライフを1減らし，無敵状態にする
+        戻り値：ライフが0以下になったらTrue
+        """
+        bird, l_scr = self.bird, self.l_scr
+        if bird.state != "normal":
+            return False
+        l_scr.valu-=1
+        bird.state = "hyper"
+        bird.hyper_life = 50
+        return l_scr.valu <= 0
+
+    def collide(self) -> str | None:
+        """
+        移動後の位置で当たり判定を行う
+        戻り値：ゲームオーバーなら"over"，ゲームクリアなら"clear"，続行ならNone
+        """
+        bird, boss, score = self.bird, self.boss, self.score
+        beams, bombs, emys, exps, bossbombs = self.beams, self.bombs, self.emys, self.exps, self.bossbombs
+        self.beam_grid.rebuild()
+        self.deathk_grid.rebuild()
+
+        for emy in self.beam_grid.groupcollide(emys, True, True).keys():  # ビームと衝突した敵機リスト
+            exps.add(self.exp_pool.get(emy.rect.center, 100))  # 爆発エフェクト
+            score.value += 10  # スコアを10点加算
+            bird.change_img(6)  # こうかとん喜びエフェクト
+
+        if len(bombs.hit_rect(bird.rect)) and self.hit_bird():  # こうかとんと衝突した爆弾リスト
+            return "over"
+
+        if self.deathk_grid.spritecollideany(bird) and self.hit_bird():  # デスこうかとんに触れた
+            return "over"
+
+        collisions = self.deathk_grid.groupcollide(beams, True, True)  # デスこうかとんとビームの衝突リスト
+        for deathk in collisions.values():
+            for d in deathk:
+                d.kill()
+
+        if bossbombs and beams:  # 全ビームと全爆弾を一括で判定する
+            sprites = beams.sprites()
+            owners, centers = bossbombs.hit_rects([beam.rect for beam in sprites])  # 衝突したビームの添字と爆弾の中心座標
+            for i, center in zip(owners.tolist(), centers.astype(int).tolist()):
+                sprites[i].kill()
+                exps.add(self.exp_pool.get(center, 50))  # 爆発エフェクト
+        if score.value < 50:  # ボスは50点以上で出現する
+            return None
+        #こうかとんが弾と衝突したら
+        if len(bossbombs.hit_rect(bird.rect)) and self.hit_bird():
+            return "over"
+        #bossがこうかとんと衝突したら
+        if boss.rect.colliderect(bird.rect) and self.hit_bird():
+            return "over"
+        #bossとビームが衝突したら
+        if self.beam_grid.spritecollide(boss, True):
+            boss.hp -= 1
+            if boss.hp <= 0:
+                return "clear"  # ゲームクリア
+        return None
+
+    def tick(self, key_lst: list[bool]) -> str | None:
+        """
+        ゲームを1tick進める．全ての対象を ai → physics の順に1回ずつ動かしてから当たり判定を行う
+        引数 key_lst：押下キーの真理値リスト
+        戻り値：ゲームオーバーなら"over"，ゲームクリアなら"clear"，続行ならNone
+        """
+        self.key_lst = key_lst
+        save_positions([self.bird, self.boss], self.beams, self.exps, self.deathks, self.flying_enemy)
+        for phase in Scheduler.phases:
+            self.sched.run(phase)
+            self.prof.mark(phase)
+        result = self.collide()
+        self.prof.mark("collision")
+        self.tmr += 1
+        return result
+
+    def counts(self) -> dict[str, int]:
+        """
+        グループごとのスプライト数を返す
+        """
+        return {
+            "beams": len(self.beams),
+            "bombs": len(self.bombs),
+            "bossbombs": len(self.bossbombs),
+            "exps": len(self.exps),
+            "deathks": len(self.deathks),
+            "flying_enemy": len(self.flying_enemy),
+        }
+
+    def draw(self, screen: pg.Surface, alpha: float, dirty_rects: DirtyRects):
+        """
+        背景を描き直し，前tickと現tickの間の位置に補間した全スプライトを奥から順に描画待ちに加える
+        引数1 screen：画面Surface
+        引数2 alpha：前tickから現tickまでの進み具合（0.0～1.0）
+        引数3 dirty_rects：描画領域の記録
+        """
+        cam_x = self.camera.offset(alpha)
+        dirty_rects.erase(screen, cam_x) # 背景画像と床・階層の描画
+        dirty_rects.add_sprites([self.boss], alpha, cam_x)
+        dirty_rects.add_bullets(self.bossbombs, alpha, cam_x)
+        dirty_rects.add_sprites(self.beams, alpha, cam_x)
+        dirty_rects.add_sprites(self.exps, alpha, cam_x)
+        dirty_rects.add_sprites(self.deathks, alpha, cam_x)
+        dirty_rects.add_sprites([self.bird], alpha, cam_x)
+        dirty_rects.add_bullets(self.bombs, alpha, cam_x)
+        dirty_rects.add_sprites(self.flying_enemy, alpha, cam_x)
+        dirty_rects.add(self.l_scr.render(), self.l_scr.rct)  # 残りライフ
+
+
+class ScriptedInput:
+    """
+    キーボードの代わりに，台本どおりの押下キーとビーム発射を1tickずつ返すクラス
+    """
+    demo = [  # （継続tick数, 押下キー, ビーム発射間隔tick数（0：発射しない））
+        (40, (pg.K_d,), 10),
+        (10, (pg.K_d, pg.K_SPACE), 0),
+        (60, (pg.K_a,), 10),
+        (10, (pg.K_a, pg.K_SPACE), 0),
+        (20, (pg.K_w,), 5),
+        (20, (), 0),
+    ]
+
+    def __init__(self, script: list[tuple[int, tuple[int, ...], int]] | None = None):
+        """
+        引数 script：（継続tick数, 押下キー, ビーム発射間隔）のリスト．最後まで進むと先頭に戻る
+        """
+        self.script = script if script is not None else __class__.demo
+        self.step = 0  # 台本の何行目か
+        self.count = 0  # その行を何tick続けたか
+
+    def poll(self) -> tuple[dict[int, bool], int] | None:
+        """
+        次の1tick分の入力を返す
+        戻り値：押下キーの真理値辞書と，そのtickの前に発射するビーム数のタプル
+        """
+        ticks, keys, every = self.script[self.step]
+        key_lst = collections.defaultdict(bool, {k: True for k in keys})
+        fires = int(every > 0 and self.count % every == 0)
+        self.count += 1
+        if self.count >= ticks:
+            self.step = (self.step+1) % len(self.script)
+            self.count = 0
+        return key_lst, fires
+
+
+class Replay:
+    """
+    乱数の種と1tickごとの入力を記録し，ファイルへの保存と再生を行うクラス
+    入力は1tickあたり1バイト（下位5ビット：押下キー，上位3ビット：ビーム発射数）で保存する
+    発射数が7以上のときは，続くバイトに残りの数を書く（255なら更に次のバイトに続く）
+    """
+    keys = [pg.K_w, pg.K_s, pg.K_a, pg.K_d, pg.K_SPACE]  # 記録するキー（下位ビットから順）
+    header = struct.Struct("<4sBQ")  # 識別子，版数，乱数の種
+    magic = b"KKRP"
+    version = 3  # 記録の形式か1tickの更新順が変わったら上げる（古い記録は再生できない）
+
+    def __init__(self, seed: int, frames: bytes = b""):
+        """
+        引数1 seed：ゲームに与えた乱数の種
+        引数2 frames：記録済みの入力バイト列
+        """
+        if not 0 <= seed < 2**64:  # 保存できない種はプレイを始める前に弾く
+            raise ValueError(f"乱数の種 {seed} は0以上2**64未満でなければ記録できません")
+        self.seed = seed
+        self.frames = bytearray(frames)
+        self.pos = 0  # 再生位置
+
+    def record(self, key_lst: list[bool], fires: int):
+        """
+        1tick分の入力を記録する
+        引数1 key_lst：押下キーの真理値リスト
+        引数2 fires：そのtickの前に発射したビーム数
+        """
+        bits = 0
+        for i, k in enumerate(__class__.keys):
+            if key_lst[k]:
+                bits |= 1 << i
+        self.frames.append(bits | min(fires, 7) << 5)
+        if fires >= 7:  # 3ビットに収まらない分は続くバイトに書く
+            rest = fires - 7
+            while rest >= 255:
+                self.frames.append(255)
+                rest -= 255
+            self.frames.append(rest)
+
+    def poll(self) -> tuple[dict[int, bool], int] | None:
+        """
+        記録した入力を1tick分返す
+        戻り値：押下キーの真理値辞書とビーム発射数のタプル（記録の終わり：None）
+        """
+        if self.pos >= len(self.frames):
+            return None
+        byte = self.frames[self.pos]
+        self.pos += 1
+        key_lst = collections.defaultdict(bool)
+        for i, k in enumerate(__class__.keys):
+            key_lst[k] = bool(byte >> i & 1)
+        fires = byte >> 5
+        if fires == 7:  # 続くバイトに残りの発射数がある
+            while True:
+                rest = self.frames[self.pos]
+                self.pos += 1
+                fires += rest
+                if rest < 255:
+                    break
+        return key_lst, fires
+
+    def save(self, path: str):
+        """
+        記録をファイルに保存する
+        引数 path：保存先のファイル名
+        """
+        with open(path, "wb") as f:
+            f.write(__class__.header.pack(__class__.magic, __class__.version, self.seed))
+            f.write(zlib.compress(bytes(self.frames)))
+
+    @classmethod
+    def load(cls, path: str) -> "Replay":
+        """
+        ファイルから記録を読み込む
+        引数 path：記録ファイル名
+        戻り値：先頭から再生するReplay
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed = cls.header.unpack_from(data)
+        if magic != cls.magic:
+            raise ValueError(f"{path} はリプレイファイルではありません")
+        if version != cls.version:
+            raise ValueError(f"{path} は版数{version}のリプレイで，この版（{cls.version}）では再生できません")
+        return cls(seed, zlib.decompress(data[cls.header.size:]))
+
+
+def simulate(ticks: int, inputs: "ScriptedInput | Replay | None" = None, seed: int | None = None,
+             prof: "Profiler | None" = None, check_updates: bool = False) -> dict:
+    """
+    画面描画もフレームレート制限もなしに，できるだけ速くゲームを進める
+    引数1 ticks：進める最大tick数
+    引数2 inputs：入力の台本またはリプレイ（None：デモ用の台本）
+    引数3 seed：乱数の種（リプレイの場合はリプレイの種を使う）
+    引数4 prof：処理段階ごとの計測器（None：CSVを書き出さない計測器を作る）
+    引数5 check_updates：1tickに2回更新されるスプライトがないか毎tick調べるか
+    戻り値：進めたtick数，経過秒数，1秒あたりのtick数，結果，段階ごとの処理時間を持つ辞書
+    """
+    if inputs is None:
+        inputs = ScriptedInput()
+    if isinstance(inputs, Replay):
+        seed = inputs.seed
+    game = Game(seed, prof, check_updates=check_updates)
+    result = None
+    start = time.perf_counter()
+    while game.tmr < ticks and result is None:
+        game.prof.begin_frame()
+        polled = inputs.poll()
+        if polled is None:  # リプレイの終わり
+            break
+        key_lst, fires = polled
+        for _ in range(fires):
+            game.fire()
+        game.prof.mark("input")
+        result = game.tick(key_lst)
+        game.prof.end_frame(game.counts())
+    elapsed = time.perf_counter() - start
+    return {
+        "ticks": game.tmr,
+        "seconds": elapsed,
+        "tps": game.tmr / elapsed if elapsed > 0 else 0.0,
+        "result": result,
+        "stages": game.prof.summary(),
+    }
+
+
+class Scene:
+    """
+    画面（タイトル・プレイ中・ゲームオーバー・ゲームクリア）の基底クラス
+    main()が毎フレーム，イベントをhandle()に渡し，update()で次の画面を決め，draw()で描画する
+    """
+    fps = 20  # この画面の描画フレームレートの上限（0：上限なし）
+
+    def pacing(self) -> str:
+        """
+        フレームの進め方を返す
+        "full"：fpsを上限に描画し続ける
+        "paused"／"background"／"idle"：一時停止中／ウィンドウが非アクティブ／動きのない画面．入力があるまで眠る
+        """
+        return "idle"
+
+    def wake_ms(self) -> int:
+        """
+        入力がなくても次のフレームに進むまでの最長時間[ms]を返す
+        """
+        return IDLE_WAIT
+
+    def handle(self, event: pg.event.Event):
+        """
+        イベントを1つ処理する
+        引数 event：イベント
+        """
+
+    def update(self, dt: int) -> "Scene | None":
+        """
+        画面の状態を進める
+        引数 dt：前フレームからの経過時間[ms]
+        戻り値：次のフレームの画面（続けるならself，終了するならNone）
+        """
+        return self
+
+    def draw(self, screen: pg.Surface):
+        """
+        画面を描画して反映する
+        引数 screen：画面Surface
+        """
+
+    def counts(self) -> dict[str, int]:
+        """
+        計測器に表示する個数を返す
+        """
+        return {}
+
+    def close(self):
+        """
+        画面を離れるときの後片付けをする
+        """
+
+
+class TitleScene(Scene):
+    """
+    タイトル画面．ESCキーでプレイ画面に移る
+    表示している間に，ゲームで使う画像を裏で読み込み，進み具合を画面下に表示する
+    """
+    bg = "fig/Game-battle-background-1024x576.png"
+
+    def __init__(self, play_args: dict):
+        """
+        引数 play_args：プレイ画面（PlayScene）を作るときの引数の辞書
+        """
+        self.play_args = play_args
+        self.started = False  # ESCキーが押されたか
+        self.drawn = False  # 描画済みか（静止画なので，読み込みが進んだときだけ描き直す）
+        self.bg_drawn = None  # 描いた背景が画像か（None：まだ何も描いていない）
+        ASSETS.start_preload()
+        self.progress = ASSETS.poll()  # 画像の事前読み込みの進み具合
+        self.font = pg.font.Font(None, 30)
+
+    def wake_ms(self) -> int:
+        if self.progress < 1.0:  # 読み込み中は進み具合を見に，こまめに起きる
+            return 1000 // __class__.fps
+        return IDLE_WAIT
+
+    def handle(self, event: pg.event.Event):
+        if event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:  # エスケープキーが押されたら
+            self.started = True
+
+    def update(self, dt: int) -> Scene | None:
+        if self.started:
+            return PlayScene(**self.play_args)  # 読み込み中の画像は使うときに待つ
+        if self.progress < 1.0:
+            progress = ASSETS.poll()
+            self.drawn = self.drawn and progress == self.progress
+            self.progress = progress
+        return self
+
+    def draw(self, screen: pg.Surface):
+        if self.drawn:
+            return
+        bg_ready = ASSETS.ready(__class__.bg)
+        if self.bg_drawn != bg_ready or self.progress >= 1.0:  # 全体は背景が届いたときと読み込み完了時だけ描き直す
+            pg.display.set_caption("title")
+            if bg_ready:
+                screen.blit(ASSETS.scaled(__class__.bg, screen.get_size()), [0, 0])
+            else:  # 背景のデコードが終わるまでは黒で待つ
+                screen.fill((0, 0, 0))
+            game_start(screen)  # タイトル画面の関数を呼び出し
+            self.bg_drawn = bg_ready
+        if self.progress < 1.0:  # 進み具合の表示欄だけ描き直す
+            panel = pg.Rect(WIDTH/2-210, HEIGHT-110, 420, 60)
+            bar = pg.Rect(panel.x+10, panel.bottom-30, panel.width-20, 20)
+            screen.fill((0, 0, 0), panel)
+            pg.draw.rect(screen, (255, 255, 255), bar, 2)
+            pg.draw.rect(screen, (255, 255, 255), (bar.x, bar.y, bar.width*self.progress, bar.height))
+            txt = self.font.render(f"Loading {self.progress:.0%}", True, (255, 255, 255))
+            screen.blit(txt, txt.get_rect(midbottom=(bar.centerx, bar.top-5)))
+            pg.display.update(panel)
+        self.drawn = True
+
+
+class PlayScene(Scene):
+    """
+    プレイ中の画面
+    シミュレーションはtick_rateの固定間隔で進め，描画はfpsを上限にできるだけ行う
+    """
+    def __init__(self, prof: Profiler, dirty: bool = False, tick_rate: int = TICK_RATE, fps: int = FPS,
+                 seed: int | None = None, record: str | None = None, replay: Replay | None = None,
+                 check_updates: bool = False):
+        """
+        引数1 prof：処理段階ごとの計測器（F3キーで表示を切り替える）
+        引数2 dirty：変化した領域だけを画面に反映する差分描画モードにするか
+        引数3 tick_rate：1秒あたりのシミュレーション回数
+        引数4 fps：描画フレームレートの上限（0：上限なし）
+        引数5 seed：乱数の種（None：毎回異なる．記録時は自動で決める）
+        引数6 record：入力を記録するリプレイファイル名
+        引数7 replay：キーボードの代わりに再生するリプレイ
+        引数8 check_updates：1tickに2回更新されるスプライトがないか毎tick調べるか
+        """
+        pg.display.set_caption("こうかとんの村")
+        if replay is not None:
+            seed = replay.seed
+        elif record is not None and seed is None:
+            seed = random.randrange(2**32)  # 再現できるよう種を決めておく
+        self.game = Game(seed, prof, check_updates=check_updates)
+        self.prof = prof
+        self.fps = fps
+        self.record = record
+        self.replay = replay
+        self.recorder = Replay(seed) if record is not None else None
+        self.fires = 0  # 次のtickまでに発射したビーム数
+        self.dirty_rects = DirtyRects(self.game.stage, dirty)  # 描画領域の記録
+        self.tick_ms = 1000 / tick_rate  # 1tickの長さ[ms]
+        self.lag = 0.0  # まだシミュレーションしていない経過時間[ms]
+        self.paused = False  # Pキーで一時停止中か
+        self.background = False  # ウィンドウが非アクティブか（非アクティブの間は自動で一時停止）
+        self.frozen = False  # 止まった画面を描画済みか
+        self.font = pg.font.Font(None, 100)
+
+    def pacing(self) -> str:
+        if self.paused:
+            return "paused"
+        if self.background:
+            return "background"
+        return "full"
+
+    def handle(self, event: pg.event.Event):
+        if event.type == pg.KEYDOWN and event.key == pg.K_RETURN and self.replay is None and self.pacing() == "full":
+            self.game.fire()
+            self.fires += 1
+        if event.type == pg.KEYDOWN and event.key == pg.K_F3:
+            self.prof.toggle()
+            self.frozen = False
+        if event.type == pg.KEYDOWN and event.key == pg.K_p:
+            self.paused = not self.paused
+            self.frozen = False
+            self.dirty_rects.full = True  # 「PAUSE」の文字を消すため画面全体を描き直す
+        if event.type == pg.WINDOWFOCUSLOST:
+            self.background = True
+        if event.type == pg.WINDOWFOCUSGAINED:
+            self.background = False
+        if event.type == pg.WINDOWEXPOSED:  # 隠れていた画面が見えたら描き直す
+            self.frozen = False
+            self.dirty_rects.full = True
+
+    def update(self, dt: int) -> Scene | None:
+        if self.pacing() != "full":  # 止まっている間は時間を進めない
+            self.lag = 0.0
+            return self
+        self.frozen = False
+        self.lag = min(self.lag + dt, self.tick_ms * MAX_TICKS)  # 処理落ち時は追いつくのを諦める
+        key_lst = pg.key.get_pressed()
+        while self.lag >= self.tick_ms:  # 経過時間分だけ固定間隔でシミュレーションを進める
+            self.lag -= self.tick_ms
+            if self.replay is not None:
+                polled = self.replay.poll()
+                if polled is None:  # リプレイの終わり
+                    return None
+                key_lst, self.fires = polled
+                for _ in range(self.fires):
+                    self.game.fire()
+            if self.recorder is not None:
+                self.recorder.record(key_lst, self.fires)
+            self.fires = 0
+            result = self.game.tick(key_lst)
+            if result == "over":
+                return EndScene(game_over)
+            if result == "clear":
+                return EndScene(game_clear)  # ゲームクリア
+        return self
+
+    def draw(self, screen: pg.Surface):
+        if self.frozen:  # 止まった画面は描き直さない
+            return
+        self.game.draw(screen, self.lag / self.tick_ms, self.dirty_rects)
+        if self.prof.visible:
+            self.dirty_rects.add(self.prof.render(), self.prof.rect)
+        if self.paused:
+            txt = self.font.render("PAUSE", True, (255, 255, 255))
+            self.dirty_rects.add(txt, txt.get_rect(center=(WIDTH//2, HEIGHT//2)))
+        self.dirty_rects.render(screen)
+        self.prof.mark("draw")
+        self.dirty_rects.flush()
+        self.frozen = self.pacing() != "full"
+
+    def counts(self) -> dict[str, int]:
+        return self.game.counts() | {"culled": self.dirty_rects.culled}
+
+    def close(self):
+        if self.recorder is not None:  # 途中で終了しても記録を残す
+            self.recorder.save(self.record)
+
+
+class EndScene(Scene):
+    """
+    ゲームオーバー・ゲームクリア画面．最後のプレイ画面の上に重ねて一定時間表示したら終了する
+    """
+    def __init__(self, show, duration: int = 5000):
+        """
+        引数1 show：画面を描く関数（game_overまたはgame_clear）
+        引数2 duration：表示時間[ms]
+        """
+        self.show = show
+        self.left = duration  # 残り表示時間[ms]
+        self.drawn = False  # 描画済みか（静止画なので1回だけ描く）
+
+    def wake_ms(self) -> int:
+        return max(1, min(IDLE_WAIT, self.left))
+
+    def update(self, dt: int) -> Scene | None:
+        self.left -= dt
+        return self if self.left > 0 else None
+
+    def draw(self, screen: pg.Surface):
+        if not self.drawn:
+            self.show(screen)
+            self.drawn = True
+
+
+def main(dirty: bool = False, tick_rate: int = TICK_RATE, fps: int = FPS,
+         seed: int | None = None, record: str | None = None, replay: Replay | None = None,
+         prof: Profiler | None = None, check_updates: bool = False):
+    """
+    ゲームのメインループ
+    タイトル，プレイ中，ゲームオーバー・ゲームクリアの画面を順に切り替える．
+    どの画面でもイベントを処理し続け，画面ごとのフレームレートを上限に描画する．
+    動きのない画面や一時停止中は，入力があるまで（最長IDLE_WAITミリ秒）眠って電力を抑える
+    引数1 dirty：変化した領域だけを画面に反映する差分描画モードにするか
+    引数2 tick_rate：1秒あたりのシミュレーション回数
+    引数3 fps：プレイ中の描画フレームレートの上限（0：上限なし）
+    引数4 seed：乱数の種（None：毎回異なる．記録時は自動で決める）
+    引数5 record：入力を記録するリプレイファイル名
+    引数6 replay：キーボードの代わりに再生するリプレイ
+    引数7 prof：処理段階ごとの計測器（F3キーで表示を切り替える）
+    引数8 check_updates：1tickに2回更新されるスプライトがないか毎tick調べるか
+    """
+    screen = pg.display.set_mode((WIDTH, HEIGHT))  # 画像は使う画面で初めて読み込むので，すぐにタイトルを出せる
+    if prof is None:
+        prof = Profiler()
+    scene = TitleScene({"prof": prof, "dirty": dirty, "tick_rate": tick_rate, "fps": fps,
+                        "seed": seed, "record": record, "replay": replay, "check_updates": check_updates})
+    clock = pg.time.Clock()
+    try:
+        while scene is not None:
+            prof.begin_frame()
+            pacing = scene.pacing()
+            events = []
+            if pacing != "full":  # 入力があれば即座に起きる
+                event = pg.event.wait(scene.wake_ms())
+                if event.type != pg.NOEVENT:
+                    events.append(event)
+            prof.mark("wait")
+            for event in events + pg.event.get():
+                if event.type == pg.QUIT:
+                    return 0
+                scene.handle(event)
+            prof.mark("input")
+            dt = clock.tick(scene.fps if pacing == "full" else 0)
+            prof.mark("wait")
+            nxt = scene.update(dt)
+            if nxt is not scene:
+                scene.close()
+                scene = nxt
+                if scene is None:
+                    break
+            scene.draw(screen)
+            prof.mark("flip")
+            prof.end_frame(scene.counts(), pacing)
+    finally:
+        if scene is not None:
+            scene.close()
+        prof.close()
+
+
+def seed_arg(text: str) -> int:
+    """
+    コマンドラインの乱数の種を，リプレイに保存できる0以上2**64未満の整数にそろえる
+    引数 text：コマンドラインの文字列
+    戻り値：乱数の種
+    """
+    return int(text) % 2**64
 
 
 if __name__ == "__main__":
-    pg.init()
-    main()
+    parser = argparse.ArgumentParser(description="こうかとんの村")
+    parser.add_argument("--dirty", action="store_true", help="変化した領域だけを画面に反映する")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE, help="1秒あたりのシミュレーション回数")
+    parser.add_argument("--fps", type=int, default=FPS, help="描画フレームレートの上限（0：上限なし）")
+    parser.add_argument("--headless", type=int, metavar="TICKS", help="画面なしで指定tick数だけ高速に進める")
+    parser.add_argument("--seed", type=seed_arg, help="敵や爆弾の出現に使う乱数の種（2**64で割った余りを使う）")
+    parser.add_argument("--record", metavar="FILE", help="乱数の種と入力をリプレイファイルに記録する")
+    parser.add_argument("--replay", metavar="FILE", help="リプレイファイルの入力で再生する")
+    parser.add_argument("--profile-csv", metavar="FILE", help="フレームごとの段階別処理時間をCSVに書き出す")
+    parser.add_argument("--check-updates", action="store_true", help="1tickに2回更新されるスプライトがないか毎tick調べる（開発用）")
+    args = parser.parse_args()
+    replay = Replay.load(args.replay) if args.replay else None
+    if args.headless is not None:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"  # ウィンドウを開かない
+        pg.init()
+        prof = Profiler(csv_path=args.profile_csv)
+        try:
+            stats = simulate(args.headless, replay, args.seed, prof, args.check_updates)
+        finally:
+            prof.close()
+        print(f"headless: {stats['ticks']} ticks in {stats['seconds']:.2f}s "
+              f"({stats['tps']:.0f} ticks/s), result={stats['result']}")
+        for stage, (p50, p95, peak) in stats["stages"].items():
+            print(f"  {stage:<10} p50={p50:.3f}ms p95={p95:.3f}ms max={peak:.3f}ms")
+    else:
+        pg.init()
+        main(dirty=args.dirty, tick_rate=args.tick_rate, fps=args.fps,
+             seed=args.seed, record=args.record, replay=replay,
+             prof=Profiler(csv_path=args.profile_csv), check_updates=args.check_updates)
+    print(ASSETS.report())
     pg.quit()
     sys.exit()